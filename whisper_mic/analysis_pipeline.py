@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from typing import List
+
+from metrics import ANALYSIS_SECONDS, DROPPED_SEGMENTS
+from utils import get_logger
+
+# 無音のときに誤って文字起こしされやすい定型文
+SENT_FILTERED = [
+    "ご視聴ありがとうございました",
+    "チャンネル登録をお願いします",
+    "次回もお会いしましょう",
+    "ご覧いただきありがとうございます"
+]
+
+
+class AnalysisPipeline:
+    """
+    文字起こし結果の感情解析・ネガポジ判定・VRChatへの送信を別スレッドで行う
+
+    submitは待たずに戻る。キューが一杯のときはpolicyに従い、
+    "drop"なら新しいテキストを捨て、"coalesce"なら溜まっているテキストとまとめて1件にする。
+    ワーカーは溜まっているテキストを最大batch_size件まとめて取り出し、ネガポジ判定を1回の推論で行う。
+    VRChatの表情を変えた後はcooldown秒の間、解析を行わない。
+    """
+
+    def __init__(
+        self,
+        emotion_analyzer,
+        sentiment_analyzer,
+        vrchat_manager,
+        vrchat: bool = False,
+        sent_filtered: List[str] = None,
+        workers: int = 1,
+        maxsize: int = 8,
+        policy: str = "coalesce",
+        cooldown: float = 5,
+        batch_size: int = 8,
+    ) -> None:
+        if policy not in ("drop", "coalesce"):
+            raise ValueError(f"Unknown policy: {policy}")
+
+        self.logger = get_logger("whisper_mic.analysis", "info")
+        self.emotion_analyzer = emotion_analyzer
+        self.sentiment_analyzer = sentiment_analyzer
+        self.vrchat_manager = vrchat_manager
+        self.vrchat = vrchat
+        self.sent_filtered = sent_filtered or []
+        self.policy = policy
+        self.cooldown = cooldown
+        self.batch_size = batch_size
+
+        self.text_queue: "queue.Queue[str]" = queue.Queue(maxsize=maxsize)
+        self.paused_until = 0.0
+        self.dropped = 0
+        self.coalesced = 0
+
+        self.break_threads = False
+        self.worker_threads = [threading.Thread(target=self.__analyze_forever, daemon=True) for _ in range(workers)]
+
+    def start(self) -> None:
+        for thread in self.worker_threads:
+            thread.start()
+
+    def join(self) -> None:
+        """
+        キューに入っているテキストの解析が終わるまで待つ
+        """
+        self.text_queue.join()
+
+    def stop(self) -> None:
+        self.break_threads = True
+        for thread in self.worker_threads:
+            thread.join()
+
+    def submit(self, text: str) -> None:
+        if text == "" or time.monotonic() < self.paused_until:
+            return
+
+        # 無音状態での文字起こしへの対応
+        for sent in self.sent_filtered:
+            if sent in text:
+                return
+
+        try:
+            self.text_queue.put_nowait(text)
+            return
+        except queue.Full:
+            pass
+
+        if self.policy == "drop":
+            self.dropped += 1
+            DROPPED_SEGMENTS.inc(reason="analysis_queue_full")
+            return
+
+        backlog = []
+        while True:
+            try:
+                backlog.append(self.text_queue.get_nowait())
+            except queue.Empty:
+                break
+            # まとめた分はjoinで待つ対象から外す
+            self.text_queue.task_done()
+
+        self.coalesced += len(backlog)
+        try:
+            self.text_queue.put_nowait("".join(backlog) + text)
+        except queue.Full:
+            self.dropped += 1
+            DROPPED_SEGMENTS.inc(reason="analysis_queue_full")
+
+    def __take_batch(self) -> List[str]:
+        try:
+            texts = [self.text_queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        # 待たずに取り出せる分だけまとめる
+        while len(texts) < self.batch_size:
+            try:
+                texts.append(self.text_queue.get_nowait())
+            except queue.Empty:
+                break
+        return texts
+
+    def __analyze_forever(self) -> None:
+        while not self.break_threads:
+            texts = self.__take_batch()
+
+            if not texts:
+                continue
+
+            try:
+                # 表情変更後のクールダウン中に溜まっていたものは解析しない
+                if time.monotonic() >= self.paused_until:
+                    self.__analyze(texts)
+            except Exception as e:
+                self.logger.warning(f"Analysis failed: {e}")
+            finally:
+                for _ in texts:
+                    self.text_queue.task_done()
+
+    def __analyze(self, texts: List[str]) -> None:
+        start = time.perf_counter()
+        emotions_list = [self.emotion_analyzer.extract_emotion(text) for text in texts]
+        ANALYSIS_SECONDS.observe(time.perf_counter() - start, stage="emotion")
+
+        start = time.perf_counter()
+        sentiments_list = self.sentiment_analyzer.extract_batch(texts)
+        ANALYSIS_SECONDS.observe(time.perf_counter() - start, stage="sentiment")
+
+        for emotions, sentiments in zip(emotions_list, sentiments_list):
+            self.logger.info(f"emotion: {emotions}")
+            self.logger.info(f"sentiment: {sentiments}")
+
+            if self.vrchat:
+                start = time.perf_counter()
+                disable_emotion_analysis = self.vrchat_manager.change_expression(emotions, sentiments)
+                # 送信はOSCSchedulerの送信スレッドが行うため、ここで測るのは送信待ちに入れるまで
+                ANALYSIS_SECONDS.observe(time.perf_counter() - start, stage="osc_update")
+
+                if disable_emotion_analysis:
+                    # 表情を変えたので、同じバッチの残りでは変えない
+                    self.paused_until = time.monotonic() + self.cooldown
+                    return
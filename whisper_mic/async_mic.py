@@ -0,0 +1,96 @@
+import asyncio
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Optional
+
+from whisper_mic import WhisperMic
+
+
+class AsyncWhisperMic:
+    """
+    WhisperMicのasyncio版API
+
+    モデルの推論はexecutor上で実行し、マイクからの音声はasyncio.Queueで受け取る。
+    stream()のイテレーションを抜けるかタスクがキャンセルされると録音を止める。
+    ファイルなどの音声ソースが終わった場合は、最後の発話区間を文字起こししてから終了する。
+
+    Example:
+        mic = await AsyncWhisperMic.create(backend="faster_whisper")
+        async for text in mic.stream():
+            print(text)
+    """
+
+    def __init__(self, mic: WhisperMic, executor: Optional[Executor] = None) -> None:
+        self.mic = mic
+        self.executor = executor
+
+    @classmethod
+    async def create(cls, executor: Optional[Executor] = None, **kwargs) -> "AsyncWhisperMic":
+        # WhisperMicの構築はモデルの読み込みとマイクの調整を含むため、イベントループを止めないようexecutorで行う
+        loop = asyncio.get_running_loop()
+        mic = await loop.run_in_executor(executor, lambda: WhisperMic(**kwargs))
+        return cls(mic, executor)
+
+    async def listen(self, timeout=None, phrase_time_limit=None) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.mic.listen, timeout, phrase_time_limit)
+
+    async def record(self, duration=None, offset=None) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.mic.record, duration, offset)
+
+    async def stream(self, phrase_time_limit=None) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        audio_queue: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+
+        def put(data) -> None:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(audio_queue.put_nowait, data)
+
+        stop_capture = self.__start_capture(put, phrase_time_limit)
+
+        try:
+            while True:
+                data = await audio_queue.get()
+
+                # Noneは音声ソースの終わり。残っている発話区間を文字起こしして終える
+                if data is None:
+                    segment = self.mic.segmenter.flush()
+                    segments = [] if segment is None else [segment]
+                # VADを使う場合は連続したチャンクから発話区間を切り出す
+                elif self.mic.segmenter is None:
+                    segments = [data]
+                else:
+                    segments = self.mic.segmenter.process(data)
+
+                for segment in segments:
+                    result = await loop.run_in_executor(self.executor, self.mic.transcribe, segment)
+                    if result is not None:
+                        yield result
+
+                if data is None:
+                    return
+        finally:
+            stop_capture()
+
+    def __start_capture(self, put, phrase_time_limit):
+        mic = self.mic
+
+        if mic.segmenter is None:
+            stop_listening = mic.recorder.listen_in_background(
+                mic.source, lambda _, audio: put(audio.get_raw_data()), phrase_time_limit=phrase_time_limit
+            )
+            return lambda: stop_listening(wait_for_stop=False)
+
+        stop_event = threading.Event()
+
+        def capture() -> None:
+            with mic.audio_source as source:
+                while not stop_event.is_set():
+                    data = source.read()
+                    put(data)
+                    if data is None:
+                        break
+
+        threading.Thread(target=capture, daemon=True).start()
+        return stop_event.set
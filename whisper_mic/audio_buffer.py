@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+
+class AudioBuffer:
+    """
+    マイク入力(16bit PCM)を発話単位で蓄積するバッファ
+
+    書き込み側は事前確保したint16配列に追記し、読み出し側は ``get`` で
+    溜まった音声をコピーせずにNumPyのビューとして受け取る。
+    2枚の配列を交互に使うため、返したビューは次の ``get`` 呼び出しまで有効。
+    max_sizeを指定すると、読み出しが追いつかない間は古いサンプルから捨てて上限を保つ。
+    """
+
+    def __init__(self, capacity: int = 16000 * 30, max_size: Optional[int] = None) -> None:
+        if max_size is not None:
+            capacity = min(capacity, max_size)
+        self._buffers = [np.empty(capacity, dtype=np.int16), np.empty(capacity, dtype=np.int16)]
+        self._back = 0
+        self._size = 0
+        self._cond = threading.Condition()
+        self.max_size = max_size
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        with self._cond:
+            return self._size
+
+    def put(self, data) -> None:
+        samples = np.frombuffer(data, dtype=np.int16)
+
+        with self._cond:
+            if self.max_size is not None:
+                samples = self._drop_oldest(samples)
+
+            end = self._size + samples.shape[0]
+            buffer = self._buffers[self._back]
+            if end > buffer.shape[0]:
+                buffer = self._grow(end)
+
+            buffer[self._size:end] = samples
+            self._size = end
+            self._cond.notify_all()
+
+    def _drop_oldest(self, samples: np.ndarray) -> np.ndarray:
+        overflow = self._size + samples.shape[0] - self.max_size
+        if overflow <= 0:
+            return samples
+
+        self.dropped += overflow
+        if samples.shape[0] >= self.max_size:
+            self._size = 0
+            return samples[-self.max_size:]
+
+        # 残す部分を先頭に詰める(重なりのあるコピーはNumPyが扱う)
+        buffer = self._buffers[self._back]
+        buffer[:self._size - overflow] = buffer[overflow:self._size]
+        self._size -= overflow
+        return samples
+
+    def _grow(self, required: int) -> np.ndarray:
+        # 容量を倍々で拡張するので、再確保はまれにしか起きない
+        old = self._buffers[self._back]
+        capacity = old.shape[0]
+        while capacity < required:
+            capacity *= 2
+
+        buffer = np.empty(capacity, dtype=np.int16)
+        buffer[:self._size] = old[:self._size]
+        self._buffers[self._back] = buffer
+        return buffer
+
+    def get(self, min_time: float = -1.0, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        溜まっている音声をすべて取り出す
+
+        Args:
+            min_time (float): 呼び出しから最低限待つ秒数
+            timeout (float): 音声が届くまで待つ最大秒数。Noneなら無期限に待つ
+
+        Returns:
+            np.ndarray: int16のビュー。timeout内に音声が届かなければNone
+        """
+        time_start = time.monotonic()
+        deadline = None if timeout is None else time_start + timeout
+
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._size > 0:
+                    wait = time_start + min_time - now
+                    if wait <= 0:
+                        break
+                elif deadline is not None:
+                    wait = deadline - now
+                    if wait <= 0:
+                        return None
+                else:
+                    wait = None
+
+                self._cond.wait(wait)
+
+            audio = self._buffers[self._back][:self._size]
+            self._back ^= 1
+            self._size = 0
+
+        return audio
+
+    def clear(self) -> None:
+        with self._cond:
+            self._size = 0
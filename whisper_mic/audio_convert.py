@@ -0,0 +1,132 @@
+"""
+16bit PCMをバックエンドに渡すfloat32の波形に変換する
+
+変換先は使い回す作業用バッファで、発話区間ごとに配列を確保しない。
+返す配列は同じスレッド・同じslotで次に変換するまで有効なので、
+バックエンドの呼び出しが終わった後も使う場合はコピーすること。
+"""
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+SCALE = np.float32(1 / 32768)
+
+# 作業用バッファの最小の大きさ(約1秒)。これより大きい場合は2の累乗に切り上げる
+_MIN_BUCKET = 1 << 14
+# リサンプリングで一度に補間するサンプル数。一時配列の大きさを区間の長さによらず一定にする
+_RESAMPLE_BLOCK = 4096
+
+
+def _bucket_size(n: int) -> int:
+    return max(_MIN_BUCKET, 1 << (n - 1).bit_length())
+
+
+def _as_int16(data) -> np.ndarray:
+    if isinstance(data, np.ndarray):
+        return data.reshape(-1)
+    return np.frombuffer(data, dtype=np.int16)
+
+
+def _resample_into(samples: np.ndarray, audio: np.ndarray, sample_rate: int) -> None:
+    # 線形補間。np.interpはfloat64の配列を返すため、一定の大きさのブロックごとに書き込み先へ直接補間する
+    step = sample_rate / SAMPLE_RATE
+    last = samples.shape[0] - 1
+    for start in range(0, audio.shape[0], _RESAMPLE_BLOCK):
+        block = audio[start:start + _RESAMPLE_BLOCK]
+        positions = np.minimum(np.arange(start, start + block.shape[0]) * step, last)
+        left = positions.astype(np.intp)
+        right = np.minimum(left + 1, last)
+        frac = (positions - left).astype(np.float32)
+
+        block[...] = samples[left]
+        block += (samples[right].astype(np.float32) - block) * frac
+
+
+def pcm16_to_float32(
+    data, out: Optional[np.ndarray] = None, sample_rate: int = SAMPLE_RATE, normalize: Optional[float] = None
+) -> np.ndarray:
+    """
+    Args:
+        data: int16 PCMのbytesまたはnp.ndarray。float32の配列ならそのまま扱う
+        out (np.ndarray): 書き込み先。足りなければ新しく確保する
+        sample_rate (int): dataのサンプリング周波数。16kHz以外なら線形補間で16kHzにする
+        normalize (float): 指定すると最大振幅がこの値になるよう拡大・縮小する
+
+    Returns:
+        np.ndarray: [-1, 1]のfloat32の波形
+    """
+    samples = _as_int16(data)
+    # 補間すると型が変わるため、スケーリングの要否は元の型で決める
+    scale = samples.dtype != np.float32
+
+    n = samples.shape[0] if sample_rate == SAMPLE_RATE else int(samples.shape[0] * SAMPLE_RATE / sample_rate)
+    if out is None or out.shape[0] < n:
+        out = np.empty(n, dtype=np.float32)
+    audio = out[:n]
+
+    if sample_rate != SAMPLE_RATE:
+        if n > 0:
+            _resample_into(samples, audio, sample_rate)
+        if scale:
+            audio *= SCALE
+    elif scale:
+        # 1/32768は2の累乗なので、割り算と同じ値を一時配列なしで書き込める
+        np.multiply(samples, SCALE, out=audio, casting="unsafe")
+    else:
+        audio[...] = samples
+
+    if normalize is not None and n > 0:
+        peak = max(float(audio.max()), -float(audio.min()))
+        if peak > 0:
+            audio *= np.float32(normalize / peak)
+
+    return audio
+
+
+class AudioConverter:
+    """
+    スレッドごと・slotごとに作業用バッファを持ち、変換結果をそこに書き込む
+
+    バッチで複数の区間を同時に渡す場合は、区間ごとに別のslotを使う。
+    """
+
+    def __init__(self) -> None:
+        self.local = threading.local()
+
+    def __buffer(self, slot: int, n: int) -> np.ndarray:
+        buffers = getattr(self.local, "buffers", None)
+        if buffers is None:
+            buffers = self.local.buffers = {}
+
+        buffer = buffers.get(slot)
+        if buffer is None or buffer.shape[0] < n:
+            buffer = buffers[slot] = np.empty(_bucket_size(n), dtype=np.float32)
+        return buffer
+
+    def convert(self, data, slot: int = 0, sample_rate: int = SAMPLE_RATE, normalize: Optional[float] = None) -> np.ndarray:
+        samples = _as_int16(data)
+        n = samples.shape[0] if sample_rate == SAMPLE_RATE else int(samples.shape[0] * SAMPLE_RATE / sample_rate)
+        return pcm16_to_float32(samples, out=self.__buffer(slot, n), sample_rate=sample_rate, normalize=normalize)
+
+    def convert_batch(self, data_list, sample_rate: int = SAMPLE_RATE, normalize: Optional[float] = None) -> List[np.ndarray]:
+        return [self.convert(data, slot=i, sample_rate=sample_rate, normalize=normalize) for i, data in enumerate(data_list)]
+
+    def release(self) -> None:
+        """
+        このスレッドの作業用バッファを解放する
+        """
+        self.local.buffers = {}
+
+
+CONVERTER = AudioConverter()
+
+
+def to_tensor(audio: np.ndarray):
+    """
+    float32の配列をコピーせずにtorch.Tensorにする(メモリを共有する)
+    """
+    import torch
+
+    return torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))
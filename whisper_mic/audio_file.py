@@ -0,0 +1,87 @@
+import wave
+from typing import Iterator
+
+import numpy as np
+
+
+class LinearResampler:
+    """
+    チャンク単位で呼び出せる線形補間のリサンプラ
+
+    前のチャンクの最後のサンプルを保持し、チャンクの境界をまたいでも連続した位置で補間する。
+    """
+
+    def __init__(self, in_rate: int, out_rate: int = 16000) -> None:
+        self.step = in_rate / out_rate
+        # 次に出力するサンプルの位置(次のチャンクの先頭を0とした入力サンプル単位)
+        self.position = 0.0
+        self.last = None
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        if self.last is None:
+            buffer, base = samples, 0
+        else:
+            buffer, base = np.concatenate([self.last, samples]), 1
+
+        start = base + self.position
+        positions = np.arange(start, buffer.shape[0] - 1, self.step)
+        next_position = positions[-1] + self.step if positions.size else start
+
+        self.position = next_position - buffer.shape[0]
+        self.last = buffer[-1:]
+
+        return np.interp(positions, np.arange(buffer.shape[0]), buffer)
+
+
+def _to_pcm16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.round(samples), -32768, 32767).astype(np.int16)
+
+
+def _iter_wav(path: str, chunk_frames: int) -> Iterator[np.ndarray]:
+    with wave.open(path, "rb") as f:
+        channels = f.getnchannels()
+        sample_width = f.getsampwidth()
+        sample_rate = f.getframerate()
+        if sample_width != 2:
+            raise ValueError(f"{path}: only 16-bit PCM WAV is supported (got {sample_width * 8}-bit)")
+
+        yield sample_rate
+        while True:
+            data = f.readframes(chunk_frames)
+            if not data:
+                break
+            # モノラルに変換
+            yield np.frombuffer(data, dtype=np.int16).reshape(-1, channels).mean(axis=1)
+
+
+def _iter_soundfile(path: str, chunk_frames: int) -> Iterator[np.ndarray]:
+    try:
+        import soundfile
+    except ImportError as e:
+        raise ImportError(f"Reading {path} requires the soundfile package: pip install soundfile") from e
+
+    with soundfile.SoundFile(path) as f:
+        yield f.samplerate
+        for block in f.blocks(blocksize=chunk_frames, dtype="int16", always_2d=True):
+            yield block.mean(axis=1)
+
+
+def iter_pcm16(path: str, sample_rate: int = 16000, chunk_seconds: float = 1.0) -> Iterator[np.ndarray]:
+    """
+    WAV/FLACなどの音声ファイルを少しずつ読み込み、16kHzモノラルの16bit PCMとして返す
+
+    WAVは標準ライブラリのみで読み込み、それ以外はsoundfileを使う。
+    """
+    if path.lower().endswith(".wav"):
+        reader = _iter_wav(path, int(chunk_seconds * 48000))
+    else:
+        reader = _iter_soundfile(path, int(chunk_seconds * 48000))
+
+    in_rate = next(reader)
+    resampler = LinearResampler(in_rate, sample_rate) if in_rate != sample_rate else None
+
+    for samples in reader:
+        if resampler is not None:
+            samples = resampler.process(samples)
+        if samples.size:
+            yield _to_pcm16(samples)
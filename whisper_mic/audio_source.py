@@ -0,0 +1,177 @@
+import socket
+import sys
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from audio_file import iter_pcm16
+
+
+class AudioSource:
+    """
+    16kHzモノラル16bit PCMのチャンクを返す音声入力
+
+    ``with source:`` で開き、``read`` は入力が終わるとNoneを返す。
+    """
+
+    sample_rate = 16000
+    chunk_size = 1024
+
+    def __enter__(self) -> "AudioSource":
+        self.open()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def open(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def read(self) -> Optional[bytes]:
+        raise NotImplementedError
+
+
+class MicrophoneSource(AudioSource):
+    def __init__(self, microphone) -> None:
+        """
+        Args:
+            microphone: speech_recognition.Microphone
+        """
+        self.microphone = microphone
+        self.chunk_size = microphone.CHUNK
+        self.stream = None
+
+    def open(self) -> None:
+        self.stream = self.microphone.__enter__().stream
+
+    def close(self) -> None:
+        self.microphone.__exit__(None, None, None)
+        self.stream = None
+
+    def read(self) -> Optional[bytes]:
+        return self.stream.read(self.chunk_size)
+
+
+class FileSource(AudioSource):
+    """
+    WAV/FLACや生のPCM(.raw/.pcm, 16kHz 16bit モノラル)を再生する
+
+    realtimeがTrueなら実際の時間に合わせて返し、Falseならできるだけ速く返す。
+    """
+
+    def __init__(self, path: str, realtime: bool = True) -> None:
+        self.path = path
+        self.realtime = realtime
+        self.chunks = None
+
+    def open(self) -> None:
+        if self.path.lower().endswith((".raw", ".pcm")):
+            self.chunks = self.__iter_raw()
+        else:
+            self.chunks = self.__iter_decoded()
+        self.start_time = time.monotonic()
+        self.samples_read = 0
+
+    def __iter_decoded(self):
+        for samples in iter_pcm16(self.path):
+            for i in range(0, samples.shape[0], self.chunk_size):
+                yield samples[i:i + self.chunk_size].tobytes()
+
+    def __iter_raw(self):
+        with open(self.path, "rb") as f:
+            while True:
+                data = f.read(self.chunk_size * 2)
+                if not data:
+                    break
+                yield data
+
+    def read(self) -> Optional[bytes]:
+        data = next(self.chunks, None)
+        if data is None:
+            return None
+
+        self.samples_read += len(data) // 2
+        if self.realtime:
+            wait = self.start_time + self.samples_read / self.sample_rate - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        return data
+
+
+class StdinSource(AudioSource):
+    """
+    標準入力から16kHz 16bit モノラルの生PCMを読み込む
+    """
+
+    def read(self) -> Optional[bytes]:
+        data = sys.stdin.buffer.read(self.chunk_size * 2)
+        return data or None
+
+
+class SocketSource(AudioSource):
+    """
+    udp://host:port で受信したデータグラム、または tcp://host:port で受け付けた
+    1本の接続から16kHz 16bit モノラルの生PCMを読み込む
+    """
+
+    def __init__(self, url: str) -> None:
+        parsed = urlparse(url)
+        self.protocol = parsed.scheme
+        self.address = (parsed.hostname or "0.0.0.0", parsed.port)
+        self.sock = None
+        self.conn = None
+        self.pending = b""
+
+    def open(self) -> None:
+        if self.protocol == "udp":
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(self.address)
+            self.sock.settimeout(0.5)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(self.address)
+            self.sock.listen(1)
+            self.conn, _ = self.sock.accept()
+            self.conn.settimeout(0.5)
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def read(self) -> Optional[bytes]:
+        # 呼び出し側が停止を確認できるよう、データが来なければ空のbytesを返す
+        try:
+            if self.protocol == "udp":
+                data, _ = self.sock.recvfrom(65536)
+            else:
+                data = self.conn.recv(self.chunk_size * 2)
+                if not data:
+                    return None
+        except socket.timeout:
+            return b""
+
+        # サンプルの途中で切れた場合は次の読み込みに回す
+        data = self.pending + data
+        size = len(data) - len(data) % 2
+        self.pending = data[size:]
+        return data[:size]
+
+
+def create_source(spec: str, realtime: bool = True) -> AudioSource:
+    """
+    Args:
+        spec (str): "-"なら標準入力、"udp://"/"tcp://"で始まればソケット、それ以外はファイルのパス
+    """
+    if spec == "-":
+        return StdinSource()
+    if spec.startswith(("udp://", "tcp://")):
+        return SocketSource(spec)
+    return FileSource(spec, realtime=realtime)
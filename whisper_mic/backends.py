@@ -0,0 +1,225 @@
+import importlib
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from audio_convert import to_tensor
+from utils import get_logger
+
+
+@dataclass
+class Result:
+    """
+    wordsはword_timestampsに対応するバックエンドでのみ入る、単語ごとの (テキスト, 終了時刻[秒])
+    """
+
+    text: str
+    raw: Any = None
+    words: Optional[List[Tuple[str, float]]] = None
+
+
+class ASRBackend:
+    """
+    音声認識バックエンドの共通インターフェース
+
+    重いライブラリのimportとモデルの構築は ``load`` で行い、
+    ``transcribe`` は16kHzのfloat32波形(audio_convert.CONVERTERで変換したもの)を受け取って ``Result`` を返す。
+    波形は作業用バッファを指すため、``transcribe`` から戻った後は参照しないこと。
+    ``supports_word_timestamps`` がTrueのバックエンドは、``word_timestamps`` をTrueにすると ``Result.words`` を返す。
+    ``model`` で大きさの違うモデルを選べないバックエンドは ``model_selectable`` をFalseにする。
+    ``transcribe_batch`` を1回の推論で行うバックエンドは ``supports_batching`` をTrueにする。
+    ``compute_types`` は対応する推論の精度。Noneならすべて受け付ける。
+    """
+
+    supports_batching = False
+    compute_types: Optional[Tuple[str, ...]] = ("default",)
+    supports_word_timestamps = False
+    model_selectable = True
+
+    def __init__(
+        self,
+        model="base",
+        device="cpu",
+        english=False,
+        model_root="./cache",
+        compute_type: str = "default",
+        beam_size: int = 5,
+        temperature: Union[float, Tuple[float, ...]] = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0),
+        cpu_threads: int = 0,
+        num_workers: int = 1,
+    ) -> None:
+        """
+        Args:
+            compute_type (str): 推論の精度。"default"ならGPUではfloat16、CPUではint8
+            beam_size (int): ビームサーチの幅
+            temperature: サンプリング温度。タプルなら失敗時に順に上げて再デコードする
+            cpu_threads (int): CPUで推論する場合の演算スレッド数。0ならライブラリの既定値
+            num_workers (int): 並列に推論できる数(faster_whisperのみ)
+        """
+        # 対応しない精度を黙って無視すると、精度ごとの比較が同じ設定どうしの比較になってしまう
+        if self.compute_types is not None and compute_type not in self.compute_types:
+            raise ValueError(
+                f"{type(self).__name__} does not support compute_type={compute_type} "
+                f"(supported: {', '.join(self.compute_types)})"
+            )
+
+        self.model = model
+        self.device = device
+        self.english = english
+        self.model_root = model_root
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+        self.temperature = temperature
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        # 単語ごとの時刻はアラインメントの分だけ遅くなるため、必要な場合(ストリーミング)のみ有効にする
+        self.word_timestamps = False
+
+    @property
+    def on_gpu(self) -> bool:
+        return str(self.device).startswith("cuda")
+
+    def cache_key(self) -> str:
+        """
+        結果に影響する設定をまとめた文字列。設定が違うバックエンドの結果をキャッシュで取り違えないようにする
+        """
+        language = "en" if self.english else "auto"
+        return (
+            f"{type(self).__name__}:{self.model}:{language}:{self.device}:"
+            f"{self.compute_type}:{self.beam_size}:{self.temperature}:{self.word_timestamps}"
+        )
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def transcribe(self, audio_data: np.ndarray) -> Result:
+        raise NotImplementedError
+
+    def transcribe_batch(self, audio_list: List[np.ndarray]) -> List[Result]:
+        # バッチ推論に対応しないバックエンドは1件ずつ処理する
+        return [self.transcribe(audio_data) for audio_data in audio_list]
+
+    def warmup(self) -> None:
+        # 1秒の無音で初回呼び出し時の初期化コストを先に払っておく
+        self.transcribe(np.zeros(16000, dtype=np.float32))
+
+
+class NueASR(ASRBackend):
+    # rinna/nue-asrのみ
+    model_selectable = False
+
+    def load(self) -> None:
+        import nue_asr
+
+        self._nue_asr = nue_asr
+        self.audio_model = nue_asr.load_model("rinna/nue-asr")
+        self.tokenizer = nue_asr.load_tokenizer("rinna/nue-asr")
+
+    def transcribe(self, audio_data: np.ndarray) -> Result:
+        import torch
+
+        with torch.no_grad():
+            result = self._nue_asr.transcribe(self.audio_model, self.tokenizer, to_tensor(audio_data))
+        return Result(text=result.text, raw=result)
+
+
+class OpenAIWhisper(ASRBackend):
+    supports_batching = True
+    compute_types = ("default", "float16", "float32")
+    supports_word_timestamps = True
+
+    def load(self) -> None:
+        import whisper
+
+        import torch
+
+        model = self.model
+        if (model != "large" and model != "large-v2") and self.english:
+            model = model + ".en"
+
+        if self.cpu_threads > 0:
+            torch.set_num_threads(self.cpu_threads)
+
+        self.audio_model = whisper.load_model(model, device="cpu", download_root=self.model_root)
+        # 半精度はGPUでのみ使う。CPUではfloat16の演算が遅い、または未対応のため
+        self.fp16 = self.on_gpu and self.compute_type in ("default", "float16")
+        if self.compute_type == "float16" and not self.fp16:
+            get_logger("whisper_mic.backends", "info").warning("float16 is not supported on CPU, using float32")
+        if self.fp16:
+            self.audio_model = self.audio_model.half()
+            for m in self.audio_model.modules():
+                if isinstance(m, whisper.model.LayerNorm):
+                    m.float()
+        self.audio_model = self.audio_model.to(self.device)
+
+    def transcribe(self, audio_data: np.ndarray) -> Result:
+        import torch
+
+        language = "english" if self.english else "japanese"
+        with torch.no_grad():
+            result = self.audio_model.transcribe(
+                to_tensor(audio_data),
+                language=language,
+                fp16=self.fp16,
+                beam_size=self.beam_size,
+                temperature=self.temperature,
+                word_timestamps=self.word_timestamps,
+            )
+
+        words = None
+        if self.word_timestamps:
+            words = [(word["word"], word["end"]) for segment in result["segments"] for word in segment.get("words", [])]
+        return Result(text=result["text"], raw=result, words=words)
+
+    def transcribe_batch(self, audio_list: List[np.ndarray]) -> List[Result]:
+        import torch
+        import whisper
+
+        # 30秒にパディングしたメルスペクトログラムをまとめて1回でデコードする
+        n_mels = self.audio_model.dims.n_mels
+        mels = torch.stack(
+            [whisper.log_mel_spectrogram(whisper.pad_or_trim(to_tensor(audio_data)), n_mels) for audio_data in audio_list]
+        ).to(self.audio_model.device)
+        # decodeは温度を上げての再デコードを行わないため、最初の温度のみ使う
+        temperature = self.temperature[0] if isinstance(self.temperature, (list, tuple)) else self.temperature
+        options = whisper.DecodingOptions(
+            language="en" if self.english else "ja",
+            fp16=self.fp16,
+            beam_size=self.beam_size if temperature == 0 else None,
+            temperature=temperature,
+        )
+
+        with torch.no_grad():
+            results = whisper.decode(self.audio_model, mels, options)
+        return [Result(text=result.text, raw=result) for result in results]
+
+
+# name -> (module, class)。選択されたバックエンドのモジュールだけがimportされる
+_BACKENDS: Dict[str, Tuple[str, str]] = {
+    "nue_asr": ("backends", "NueASR"),
+    "whisper": ("backends", "OpenAIWhisper"),
+    "faster_whisper": ("fast_whisper", "FasterWhisper"),
+    "distil_whisper": ("distil_whisper", "DistilWhisper"),
+    "hubert": ("hubert", "Hubert"),
+}
+
+
+def register_backend(name: str, module: str, class_name: str) -> None:
+    _BACKENDS[name] = (module, class_name)
+
+
+def available_backends() -> List[str]:
+    return list(_BACKENDS)
+
+
+def backend_class(name: str) -> type:
+    if name not in _BACKENDS:
+        raise ValueError(f"Unknown backend: {name} (available: {', '.join(_BACKENDS)})")
+
+    module_name, class_name = _BACKENDS[name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_backend(name: str, **kwargs) -> ASRBackend:
+    return backend_class(name)(**kwargs)
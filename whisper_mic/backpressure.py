@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from metrics import DROPPED_SEGMENTS, REGISTRY, STAGE_SECONDS
+from utils import get_logger
+
+POLICIES = ("drop_oldest", "latest", "merge", "fallback")
+
+OVERLOAD_EVENTS = REGISTRY.counter("whisper_mic_overload_events_total", "Times segments were shed or merged because decoding fell behind, by action")
+SEGMENT_QUEUE_LENGTH = REGISTRY.gauge("whisper_mic_segment_queue_length", "Speech segments waiting to be decoded")
+
+
+class SegmentQueue:
+    """
+    デコード待ちの発話区間(int16)を溜める上限付きのキュー
+
+    一杯になったときの動作はpolicyで選ぶ。
+        drop_oldest: 一番古い区間を捨てる
+        latest: 溜まっている区間をすべて捨て、新しい区間だけを残す
+        merge: 溜まっている区間と新しい区間を1つにつなぎ、末尾max_merge秒だけを残す
+        fallback: drop_oldestと同じ。小さいモデルへの切り替えはTierRouterがpressureを見て行う
+    max_ageを指定すると、取り出す時点でmax_age秒より古い区間は捨てる。
+    アバターの操作では遅れた結果より結果がない方がよいため。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 8,
+        policy: str = "drop_oldest",
+        max_age: Optional[float] = None,
+        max_merge: float = 15.0,
+        sample_rate: int = 16000,
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy: {policy}")
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+
+        self.logger = get_logger("whisper_mic.backpressure", "info")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_age = max_age
+        self.max_merge_samples = int(max_merge * sample_rate)
+
+        self._items = deque()
+        self._cond = threading.Condition()
+
+        self.dropped = 0
+        self.merged = 0
+        self.stale = 0
+        self._last_report = 0.0
+        self._unreported = 0
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    @property
+    def pressure(self) -> float:
+        """
+        溜まっている区間の割合(0〜1)
+        """
+        return len(self) / self.maxsize
+
+    def put(self, segment) -> None:
+        segment = np.frombuffer(segment, dtype=np.int16) if isinstance(segment, (bytes, bytearray)) else segment
+        now = time.monotonic()
+
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self.__shed(segment, now)
+            else:
+                self._items.append((now, segment))
+            SEGMENT_QUEUE_LENGTH.set(len(self._items))
+            self._cond.notify()
+
+    def __shed(self, segment: np.ndarray, now: float) -> None:
+        if self.policy == "merge":
+            # 最初の区間の時刻を残し、古さの判定は溜まり始めた時点で行う
+            merged = np.concatenate([item for _, item in self._items] + [segment])[-self.max_merge_samples:]
+            count = len(self._items)
+            self.merged += count
+            self._items = deque([(self._items[0][0], merged)])
+            self.__report("merge", count)
+            return
+
+        if self.policy == "latest":
+            count = len(self._items)
+            self._items.clear()
+        else:
+            count = 1
+            self._items.popleft()
+
+        self.dropped += count
+        DROPPED_SEGMENTS.inc(count, reason=self.policy)
+        self._items.append((now, segment))
+        self.__report(self.policy, count)
+
+    def __report(self, action: str, count: int) -> None:
+        OVERLOAD_EVENTS.inc(action=action)
+
+        # 遅れが続いている間はログが溢れないよう、5秒に1回まとめて出す
+        self._unreported += count
+        now = time.monotonic()
+        if now - self._last_report >= 5:
+            self.logger.warning(
+                f"Transcription is falling behind: {action} applied to {self._unreported} segment(s) "
+                f"(dropped={self.dropped}, merged={self.merged}, stale={self.stale})"
+            )
+            self._last_report = now
+            self._unreported = 0
+
+    def get(self, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """
+        Returns:
+            np.ndarray: 一番古い区間。timeout内に区間が届かなければNone
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                while self._items:
+                    enqueued, segment = self._items.popleft()
+                    waited = time.monotonic() - enqueued
+                    if self.max_age is not None and waited > self.max_age:
+                        self.stale += 1
+                        DROPPED_SEGMENTS.inc(reason="stale")
+                        self.__report("stale", 1)
+                        continue
+                    SEGMENT_QUEUE_LENGTH.set(len(self._items))
+                    STAGE_SECONDS.observe(waited, stage="queue_wait")
+                    return segment
+
+                SEGMENT_QUEUE_LENGTH.set(0)
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    return None
+                self._cond.wait(wait)
+
+    def clear(self) -> None:
+        with self._cond:
+            self._items.clear()
+            SEGMENT_QUEUE_LENGTH.set(0)
@@ -0,0 +1,307 @@
+"""
+WhisperMicの各段階の遅延とスループットを計測する
+
+    python benchmark.py CORPUS_DIR --backend faster_whisper --model tiny --output result.json
+    python benchmark.py --synthetic 20 --backend stub --compare previous.json
+    python benchmark.py CORPUS_DIR --backend faster_whisper --compute_type int8,int8_float32,float32 --cpu_threads 4
+
+CORPUS_DIRのWAV/FLACをFileSourceでWhisperMicに1ファイルずつ入力し、listen_loopで最後まで処理する。
+各段階の時間は、WhisperMicが記録するメトリクス(metrics.py)のヒストグラムから丸める前の値を受け取って集計する。
+    read: 入力元からの読み込み(--realtimeの場合は再生速度に合わせた待ちを含む)
+    segment: VADによる発話区間の切り出し
+    queue_wait: 発話区間がデコード待ちのキューにいた時間
+    preprocess: float32への変換
+    asr: バックエンドの推論
+    decode: 変換・キャッシュの参照・モデルの選択・推論を合わせた時間
+    emotion, sentiment: 感情解析とネガポジ判定(--analysis)
+    osc_update: 表情の決定と送信待ちへの追加、osc_send: OSCバンドルの送信(--vrchat)
+--compute_typeに複数指定すると順に計測し、最初の指定に対する速度比を表示する。
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from audio_source import FileSource
+from backends import ASRBackend, Result, backend_class, register_backend
+from metrics import ANALYSIS_SECONDS, DECODE_SECONDS, DROPPED_SEGMENTS, SEGMENT_SECONDS, STAGE_SECONDS
+from offline import expand_paths
+from utils import configure_cpu
+
+STAGES = ["read", "segment", "queue_wait", "preprocess", "asr", "decode", "emotion", "sentiment", "osc_update", "osc_send"]
+
+
+class StubBackend(ASRBackend):
+    """
+    モデルを使わず、音声長 x rtf 秒待って固定の文を返す
+    """
+
+    rtf = 0.05
+    compute_types = None
+    text = "今日はとても楽しかったです"
+
+    def load(self) -> None:
+        pass
+
+    def transcribe(self, audio_data: np.ndarray) -> Result:
+        time.sleep(audio_data.shape[0] / 16000 * self.rtf)
+        return Result(text=self.text)
+
+
+register_backend("stub", "benchmark", "StubBackend")
+
+
+def synthetic_corpus(n: int, out_dir: str) -> List[str]:
+    """
+    話者の代わりに、無音を挟んだ振幅変調のトーンでn個のWAVを作る
+    """
+    import wave
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(n):
+        parts = []
+        for _ in range(3):
+            duration = rng.uniform(0.8, 3.0)
+            t = np.arange(int(duration * 16000)) / 16000
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+            parts.append(4000 * envelope * np.sin(2 * np.pi * rng.uniform(150, 300) * t))
+            parts.append(rng.normal(0, 30, int(rng.uniform(0.8, 1.5) * 16000)))
+        samples = np.clip(np.concatenate(parts), -32768, 32767).astype(np.int16)
+
+        path = os.path.join(out_dir, f"synthetic_{i:03d}.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(16000)
+            f.writeframes(samples.tobytes())
+        paths.append(path)
+    return paths
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ms = np.array(values) * 1000
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    # LinuxではKB、macOSではbytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024, 1)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class StageRecorder:
+    """
+    WhisperMicが記録するヒストグラムの値を段階ごとに集める
+    """
+
+    def __init__(self) -> None:
+        self.timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        self.segment_seconds: List[float] = []
+        self.listeners = [
+            (STAGE_SECONDS, lambda value, labels: self.__append(labels["stage"], value)),
+            (ANALYSIS_SECONDS, lambda value, labels: self.__append(labels["stage"], value)),
+            (DECODE_SECONDS, lambda value, labels: self.__append("asr", value)),
+            (SEGMENT_SECONDS, lambda value, labels: self.segment_seconds.append(value)),
+        ]
+
+    def __append(self, stage: str, value: float) -> None:
+        if stage in self.timings:
+            self.timings[stage].append(value)
+
+    def __enter__(self) -> "StageRecorder":
+        for histogram, listener in self.listeners:
+            histogram.add_listener(listener)
+        return self
+
+    def __exit__(self, *args) -> None:
+        for histogram, listener in self.listeners:
+            histogram.remove_listener(listener)
+
+
+def run(paths: List[str], mic, realtime: bool) -> dict:
+    input_seconds = 0.0
+    dropped_before = sum(DROPPED_SEGMENTS.values.values())
+
+    with StageRecorder() as recorder:
+        wall_start = time.perf_counter()
+        for path in paths:
+            mic.audio_source = FileSource(path, realtime=realtime)
+            # 文字起こし結果の表示は計測の出力に混ぜない
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                mic.listen_loop()
+            input_seconds += mic.audio_source.samples_read / mic.audio_source.sample_rate
+
+        # 解析とOSCの送信は別スレッドで続くため、終わるまで待つ
+        if mic.analysis is not None:
+            mic.analysis.join()
+            if mic.vrchat:
+                time.sleep(mic.osc_interval)
+        wall = time.perf_counter() - wall_start
+
+    timings = recorder.timings
+    segment_seconds = sum(recorder.segment_seconds)
+    asr_seconds = sum(timings["asr"])
+    result = {
+        "stages": {stage: percentiles(values) for stage, values in timings.items()},
+        "files": len(paths),
+        "segments": len(timings["decode"]),
+        "decoded_segments": len(timings["asr"]),
+        "dropped_segments": int(sum(DROPPED_SEGMENTS.values.values()) - dropped_before),
+        "audio_seconds": round(input_seconds, 3),
+        "decoded_seconds": round(segment_seconds, 3),
+        "wall_seconds": round(wall, 3),
+        "rtf": round(asr_seconds / segment_seconds, 4) if segment_seconds else None,
+        "throughput_x_realtime": round(input_seconds / wall, 3) if wall else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    if mic.transcription_cache is not None:
+        result["cache"] = mic.transcription_cache.stats()
+    return result
+
+
+def compare(current: dict, previous: dict) -> None:
+    print(f"{'stage':<12}{'p50 ms':>12}{'prev':>12}{'p95 ms':>12}{'prev':>12}")
+    for stage in STAGES:
+        now = current["stages"].get(stage, {})
+        before = previous["stages"].get(stage, {})
+        if not now.get("count"):
+            continue
+        print(
+            f"{stage:<12}{now['p50_ms']:>12}{before.get('p50_ms', '-'):>12}"
+            f"{now['p95_ms']:>12}{before.get('p95_ms', '-'):>12}"
+        )
+    print(f"rtf: {current['rtf']} (prev {previous.get('rtf')})")
+    print(f"peak_rss_mb: {current['peak_rss_mb']} (prev {previous.get('peak_rss_mb')})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="*", help="WAV/FLAC files or directories to replay")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate N synthetic files instead of a corpus")
+    parser.add_argument("--backend", default="stub")
+    parser.add_argument("--model", default="tiny")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--compute_type", default="default", help="Comma-separated compute types to compare, e.g. float32,int8")
+    parser.add_argument("--beam_size", type=int, default=5)
+    parser.add_argument("--cpu_threads", type=int, default=0)
+    parser.add_argument("--cpu_affinity", default=None)
+    parser.add_argument("--analysis", action="store_true", help="Include emotion and sentiment analysis")
+    parser.add_argument("--vrchat", action="store_true", help="Include the OSC send (implies --analysis)")
+    parser.add_argument("--pause", type=float, default=0.8, help="Seconds of silence that end a segment")
+    parser.add_argument("--realtime", action="store_true", help="Replay files in real time instead of as fast as possible")
+    parser.add_argument("--queue_size", type=int, default=1024, help="Segments waiting to be decoded before --overload applies")
+    parser.add_argument("--overload", default="drop_oldest", choices=["drop_oldest", "latest", "merge", "fallback"])
+    parser.add_argument("--adaptive", action="store_true", help="Switch to --fallback_model while behind")
+    parser.add_argument("--fallback_model", default="tiny")
+    parser.add_argument("--cache_size", type=int, default=0, help="Transcription cache entries (0 disables)")
+    parser.add_argument("--output", default=None, help="Write results as JSON")
+    parser.add_argument("--compare", default=None, help="Previous JSON result to compare against")
+    args = parser.parse_args()
+
+    paths = expand_paths(args.corpus)
+    if args.synthetic:
+        paths += synthetic_corpus(args.synthetic, os.path.join("cache", "benchmark_corpus"))
+    if not paths:
+        parser.error("no input: pass a corpus or --synthetic N")
+
+    # 対応しない精度があれば、どれかを計測する前に止める
+    compute_types = args.compute_type.split(",")
+    supported = backend_class(args.backend).compute_types
+    unsupported = [c for c in compute_types if supported is not None and c not in supported]
+    if unsupported:
+        parser.error(f"--backend {args.backend} does not support compute types {', '.join(unsupported)} (supported: {', '.join(supported)})")
+
+    configure_cpu(args.cpu_threads, affinity=args.cpu_affinity)
+
+    from whisper_mic import WhisperMic
+
+    runs = []
+    for compute_type in compute_types:
+        start = time.perf_counter()
+        mic = WhisperMic(
+            model=args.model,
+            device=args.device,
+            backend=args.backend,
+            model_root="./cache",
+            pause=args.pause,
+            vad=True,
+            source=FileSource(paths[0], realtime=args.realtime),
+            analysis=args.analysis or args.vrchat,
+            vrchat=args.vrchat,
+            cache_size=args.cache_size,
+            queue_size=args.queue_size,
+            overload=args.overload,
+            adaptive=args.adaptive,
+            fallback_model=args.fallback_model,
+            backend_options={"compute_type": compute_type, "beam_size": args.beam_size, "cpu_threads": args.cpu_threads},
+        )
+        load_seconds = time.perf_counter() - start
+
+        result = run(paths, mic, realtime=args.realtime)
+        result.update(
+            {
+                "commit": git_commit(),
+                "backend": args.backend,
+                "model": args.model,
+                "device": args.device,
+                "compute_type": compute_type,
+                "beam_size": args.beam_size,
+                "cpu_threads": args.cpu_threads,
+                "overload": args.overload,
+                "realtime": args.realtime,
+                "load_seconds": round(load_seconds, 3),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            }
+        )
+        runs.append(result)
+        # 次の精度を計測する前に解析のスレッドを止め、モデルを解放する
+        if mic.analysis is not None:
+            mic.analysis.stop()
+        del mic
+
+    if len(runs) > 1:
+        baseline = runs[0]
+        for run_result in runs:
+            speedup = baseline["rtf"] / run_result["rtf"] if run_result["rtf"] else None
+            run_result["speedup_vs_" + baseline["compute_type"]] = None if speedup is None else round(speedup, 2)
+        result = {"runs": runs}
+    else:
+        result = runs[0]
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        for current, before in zip(result.get("runs", [result]), previous.get("runs", [previous])):
+            compare(current, before)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,12 @@ import os
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
 import click
-import torch
-import speech_recognition as sr
 from typing import Optional
 
-from whisper_mic import WhisperMic
+from backends import available_backends
 
-print(torch.cuda.get_device_name(0))
-#print(torch.cuda.get_device_name(1))
 
-
-@click.command()
+@click.group(invoke_without_command=True)
 @click.option(
     "--model",
     default="base",
@@ -22,8 +17,8 @@ print(torch.cuda.get_device_name(0))
 )
 @click.option(
     "--device",
-    default=("cuda:0" if torch.cuda.is_available() else "cpu"),
-    help="Device to use",
+    default=None,
+    help="Device to use (defaults to cuda:0 when available, otherwise cpu)",
     type=click.Choice(["cpu", "cuda", "mps", "cuda:0", "cuda:0"]),
 )
 @click.option("--english", default=False, help="Whether to use English model", is_flag=True, type=bool)
@@ -37,7 +32,61 @@ print(torch.cuda.get_device_name(0))
 @click.option("--mic_index", default=None, help="Mic index to use", type=int)
 @click.option("--list_devices", default=False, help="Flag to list devices", is_flag=True, type=bool)
 @click.option("--vrchat", default=False, help="Flag to send vrchat", is_flag=True, type=bool)
+@click.option(
+    "--analysis/--no-analysis",
+    default=None,
+    help="Load the emotion and sentiment models and log their results (defaults to on with --vrchat, off otherwise)",
+)
+@click.option("--backend", default="nue_asr", help="ASR backend to use", type=click.Choice(available_backends()))
+@click.option("--prewarm", default=False, help="Flag to load models in the background while the mic starts", is_flag=True, type=bool)
+@click.option("--vad", default=False, help="Flag to segment speech with frame-level VAD instead of phrase limits", is_flag=True, type=bool)
+@click.option("--pre_roll", default=0.3, help="Seconds of audio kept before detected speech (VAD only)", type=float)
+@click.option("--phrase_time_limit", default=2, help="Max seconds per phrase in loop mode without VAD", type=float)
+@click.option("--stream", default=False, help="Flag to stream partial and committed results while speaking (loop only)", is_flag=True, type=bool)
+@click.option("--stream_step", default=0.5, help="Seconds between re-decodes of the streaming window", type=float)
+@click.option("--mic_indices", default=None, help="Comma-separated mic indices to serve with one shared, batched model", type=str)
+@click.option("--max_batch_size", default=8, help="Max segments per batch in server mode", type=int)
+@click.option("--max_latency", default=0.2, help="Max seconds to wait while filling a batch in server mode", type=float)
+@click.option("--lexicon_dir", default=None, help="Directory containing emotion_annotation.csv and emotion_category.csv", type=str)
+@click.option("--cache_size", default=0, help="Number of transcriptions to cache by audio fingerprint and backend settings (0 disables)", type=int)
+@click.option("--cache_dir", default=None, help="Directory for the on-disk transcription cache", type=str)
+@click.option("--cache_dir_size", default=256, help="Max megabytes kept in --cache_dir; the least recently used entries are removed first", type=int)
+@click.option("--source", default=None, help="Audio source instead of the mic: a WAV/FLAC/raw PCM file, '-' for stdin, or udp://host:port / tcp://host:port (16 kHz 16-bit mono PCM)", type=str)
+@click.option("--realtime/--no-realtime", default=True, help="Play file sources back in real time or as fast as possible")
+@click.option("--queue_size", default=8, help="Max speech segments (and results) waiting before the overload policy applies", type=int)
+@click.option(
+    "--overload",
+    default="drop_oldest",
+    help="What to do when decoding falls behind: drop the oldest segment, skip to the latest, merge the backlog, or decode with --fallback_model",
+    type=click.Choice(["drop_oldest", "latest", "merge", "fallback"]),
+)
+@click.option("--max_age", default=None, help="Discard queued segments older than this many seconds", type=float)
+@click.option("--fallback_model", default="tiny", help="Faster model tier used while behind (--overload fallback or --adaptive)", type=str)
+@click.option("--adaptive", default=False, help="Keep --model and --fallback_model loaded and switch between them by real-time factor and queue length", is_flag=True, type=bool)
+@click.option(
+    "--compute_type",
+    default="default",
+    help="Inference precision (faster_whisper: int8/int8_float32 on CPU; default is int8 on CPU, float16 on GPU)",
+    type=click.Choice(["default", "int8", "int8_float32", "int8_float16", "int16", "float16", "float32"]),
+)
+@click.option("--beam_size", default=5, help="Beam size for decoding", type=int)
+@click.option("--temperature", default="0,0.2,0.4,0.6,0.8,1.0", help="Comma-separated temperatures tried in order when decoding fails", type=str)
+@click.option("--cpu_threads", default=0, help="Intra-op threads per inference on CPU (0 keeps the library default)", type=int)
+@click.option("--inter_threads", default=0, help="Inter-op threads; for faster_whisper, the number of parallel decoders", type=int)
+@click.option("--cpu_affinity", default=None, help="Pin the process to these CPUs, e.g. 0-3,6 (Linux only)", type=str)
+@click.option("--osc_interval", default=0.2, help="Minimum seconds between OSC sends to VRChat", type=float)
+@click.option("--expression_reset", default=15.0, help="Seconds before the avatar expression returns to neutral", type=float)
+@click.option("--expression_service", default=False, help="Listen for VRChat OSC in-process and reset expressions changed on the avatar too (with --vrchat)", is_flag=True, type=bool)
+@click.option("--osc_listen_port", default=9001, help="Port to receive VRChat OSC on for --expression_service", type=int)
+@click.option("--multiprocess", default=False, help="Run capture, ASR and analysis in separate processes (implies loop and VAD)", is_flag=True, type=bool)
+@click.option("--capture_cpus", default=None, help="CPUs for the capture process with --multiprocess, e.g. 0", type=str)
+@click.option("--asr_cpus", default=None, help="CPUs for the ASR process with --multiprocess, e.g. 1-3", type=str)
+@click.option("--analysis_cpus", default=None, help="CPUs for the analysis process with --multiprocess, e.g. 4", type=str)
+@click.option("--paste_threshold", default=16, help="Paste dictated text of at least this many characters via the clipboard (0 always types)", type=int)
+@click.option("--metrics_port", default=None, help="Serve Prometheus-style metrics on 127.0.0.1:PORT/metrics", type=int)
+@click.pass_context
 def main(
+    ctx: click.Context,
     model: str,
     english: bool,
     verbose: bool,
@@ -50,11 +99,139 @@ def main(
     dictate: bool,
     mic_index: Optional[int],
     list_devices: bool,
-    vrchat: bool
+    vrchat: bool,
+    analysis: Optional[bool],
+    backend: str,
+    prewarm: bool,
+    vad: bool,
+    pre_roll: float,
+    phrase_time_limit: float,
+    stream: bool,
+    stream_step: float,
+    mic_indices: Optional[str],
+    max_batch_size: int,
+    max_latency: float,
+    lexicon_dir: Optional[str],
+    cache_size: int,
+    cache_dir: Optional[str],
+    cache_dir_size: int,
+    source: Optional[str],
+    realtime: bool,
+    queue_size: int,
+    overload: str,
+    max_age: Optional[float],
+    fallback_model: str,
+    adaptive: bool,
+    compute_type: str,
+    beam_size: int,
+    temperature: str,
+    cpu_threads: int,
+    inter_threads: int,
+    cpu_affinity: Optional[str],
+    osc_interval: float,
+    expression_reset: float,
+    expression_service: bool,
+    osc_listen_port: int,
+    multiprocess: bool,
+    capture_cpus: Optional[str],
+    asr_cpus: Optional[str],
+    analysis_cpus: Optional[str],
+    paste_threshold: int,
+    metrics_port: Optional[int],
 ) -> None:
+    # サブコマンドにはここで指定したオプションを渡す
+    if ctx.invoked_subcommand is not None:
+        ctx.obj = dict(ctx.params)
+        return
+
+    from utils import configure_cpu
+
+    # スレッド数の設定はtorchやモデルを読み込む前に行う
+    configure_cpu(cpu_threads, inter_threads, cpu_affinity)
+
+    # 重いモジュールは必要になるまでimportしない
     if list_devices:
+        import speech_recognition as sr
+
         print("Possible devices: ", sr.Microphone.list_microphone_names())
         return
+
+    from utils import get_default_device
+    from whisper_mic import WhisperMic
+
+    options = backend_options(ctx.params)
+
+    # VRChatに送らない場合、解析結果はログに出るだけなのでginzaとBERTを読み込まない
+    if analysis is None:
+        analysis = vrchat
+    if vrchat and not analysis:
+        raise click.UsageError("--vrchat needs --analysis to choose expressions")
+
+    from backends import backend_class
+
+    supported = backend_class(backend).compute_types
+    if supported is not None and compute_type not in supported:
+        raise click.UsageError(f"--backend {backend} does not support --compute_type {compute_type} (supported: {', '.join(supported)})")
+
+    if adaptive or overload == "fallback":
+        if not backend_class(backend).model_selectable:
+            raise click.UsageError(
+                f"--adaptive and --overload fallback need a backend that can load --fallback_model ({backend} always loads the same model)"
+            )
+
+    if metrics_port is not None:
+        from metrics import start_http_server
+
+        start_http_server(metrics_port)
+
+    if device is None:
+        device = get_default_device()
+    if device.startswith("cuda"):
+        import torch
+
+        print(torch.cuda.get_device_name(0))
+
+    if mic_indices is not None:
+        serve(
+            [int(index) for index in mic_indices.split(",")],
+            backend=backend,
+            model=model,
+            device=device,
+            english=english,
+            energy=energy,
+            pause=pause,
+            dynamic_energy=dynamic_energy,
+            max_batch_size=max_batch_size,
+            max_latency=max_latency,
+            backend_options=options,
+        )
+        return
+
+    if multiprocess:
+        from multiprocess_mic import MultiProcessMic
+
+        MultiProcessMic(
+            model=model,
+            device=device,
+            english=english,
+            backend=backend,
+            backend_options=options,
+            energy=energy,
+            pause=pause,
+            dynamic_energy=dynamic_energy,
+            pre_roll=pre_roll,
+            mic_index=mic_index,
+            source=source,
+            realtime=realtime,
+            vrchat=vrchat,
+            lexicon_dir=lexicon_dir,
+            osc_interval=osc_interval,
+            expression_reset=expression_reset,
+            analysis=analysis,
+            affinity={"capture": capture_cpus, "asr": asr_cpus, "analysis": analysis_cpus},
+        ).listen_loop(dictate=dictate, paste_threshold=paste_threshold)
+        return
+
     mic = WhisperMic(
         model=model,
         english=english,
@@ -66,13 +243,125 @@ def main(
         device=device,
         mic_index=mic_index,
         model_root="./cache",
-        vrchat=vrchat
+        vrchat=vrchat,
+        analysis=analysis,
+        backend=backend,
+        prewarm=prewarm,
+        vad=vad,
+        pre_roll=pre_roll,
+        streaming=stream,
+        stream_step=stream_step,
+        lexicon_dir=lexicon_dir,
+        cache_size=cache_size,
+        cache_dir=cache_dir,
+        cache_dir_size=cache_dir_size,
+        source=source,
+        realtime=realtime,
+        queue_size=queue_size,
+        overload=overload,
+        max_age=max_age,
+        fallback_model=fallback_model,
+        adaptive=adaptive,
+        backend_options=options,
+        osc_interval=osc_interval,
+        expression_reset=expression_reset,
+        expression_service=expression_service,
+        osc_listen_port=osc_listen_port,
     )
     if not loop:
         result = mic.listen()
-        print("You said: " + result)
+        if result is not None:
+            print("You said: " + result)
     else:
-        mic.listen_loop(dictate=dictate, phrase_time_limit=2)
+        mic.listen_loop(dictate=dictate, phrase_time_limit=phrase_time_limit, paste_threshold=paste_threshold)
+
+
+@main.command()
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--workers", default=1, help="Number of decode processes, each loading its own model", type=int)
+@click.option("--output", "-o", default=None, help="JSONL file to write (defaults to stdout)", type=str)
+@click.pass_obj
+def transcribe(options: dict, paths, workers: int, output: Optional[str]) -> None:
+    """Transcribe WAV/FLAC files or directories without a microphone."""
+    from offline import transcribe_files
+    from utils import configure_cpu
+
+    # ワーカープロセスは環境変数とCPUの割り当てを引き継ぐ
+    configure_cpu(options["cpu_threads"], options["inter_threads"], options["cpu_affinity"])
+
+    failed = transcribe_files(
+        list(paths),
+        output=output,
+        workers=workers,
+        model=options["model"],
+        device=options["device"],
+        english=options["english"],
+        energy=options["energy"],
+        pause=options["pause"],
+        dynamic_energy=options["dynamic_energy"],
+        backend=options["backend"],
+        pre_roll=options["pre_roll"],
+        cache_size=options["cache_size"],
+        cache_dir=options["cache_dir"],
+        cache_dir_size=options["cache_dir_size"],
+        model_root="./cache",
+        backend_options=backend_options(options),
+    )
+    if failed:
+        raise SystemExit(1)
+
+
+def backend_options(params: dict) -> dict:
+    """
+    CLIのオプションからASRBackendに渡す推論の設定を作る
+    """
+    temperature = tuple(float(t) for t in params["temperature"].split(","))
+    return {
+        "compute_type": params["compute_type"],
+        "beam_size": params["beam_size"],
+        "temperature": temperature[0] if len(temperature) == 1 else temperature,
+        "cpu_threads": params["cpu_threads"],
+        "num_workers": max(1, params["inter_threads"]),
+    }
+
+
+def serve(
+    mic_indices, backend, model, device, english, energy, pause, dynamic_energy, max_batch_size, max_latency, backend_options
+) -> None:
+    import threading
+
+    from backends import create_backend
+    from server import SourceStream, TranscriptionServer
+
+    asr_backend = create_backend(backend, model=model, device=device, english=english, model_root="./cache", **backend_options)
+    asr_backend.load()
+
+    server = TranscriptionServer(asr_backend, max_batch_size=max_batch_size, max_latency=max_latency)
+    server.start()
+
+    def print_results(stream_id, results):
+        while True:
+            result = results.get()
+            if isinstance(result, Exception):
+                print(f"[{stream_id}] (failed to transcribe: {result})")
+            else:
+                print(f"[{stream_id}] {result}")
+
+    threads = []
+    for mic_index in mic_indices:
+        stream = SourceStream.from_microphone(
+            server, f"mic{mic_index}", mic_index=mic_index, energy=energy, pause=pause, dynamic_energy=dynamic_energy
+        )
+        stream.start()
+        thread = threading.Thread(target=print_results, args=(stream.stream_id, stream.results), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        server.stop()
 
 
 if __name__ == "__main__":
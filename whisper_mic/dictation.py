@@ -0,0 +1,161 @@
+import os
+import platform
+import queue
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from streaming import TranscriptEvent
+from utils import get_logger
+
+
+class DictationSink:
+    """
+    文字起こし結果を別スレッドでキー入力として打ち込む
+
+    長い文字列(paste_threshold文字以上)はクリップボード経由で貼り付け、1文字ずつのキー入力を避ける。
+    ストリーミングの部分結果は打ち込んだ後で変わりうるため、打ち込み済みの文字と新しい発話全体を比べ、
+    共通の接頭辞より後ろだけをバックスペースで消して打ち直す。
+    打ち込みが追いつかない間に届いた同じ発話の部分結果は、最新のものだけを反映する。
+    """
+
+    def __init__(self, paste_threshold: int = 16, revise: bool = True, keyboard=None) -> None:
+        """
+        Args:
+            paste_threshold (int): クリップボードで貼り付ける最小の文字数。0なら常にキー入力する
+            revise (bool): 部分結果を打ち込み、変わった部分を打ち直す。Falseなら確定したテキストのみ打ち込む
+            keyboard: pynput.keyboard.Controller。省略時は作成する
+        """
+        if keyboard is None:
+            import pynput.keyboard
+
+            keyboard = pynput.keyboard.Controller()
+
+        self.logger = get_logger("whisper_mic.dictation", "info")
+        self.keyboard = keyboard
+        self.paste_threshold = paste_threshold
+        self.revise = revise
+
+        # 貼り付けにはpyperclipを使う。なければキー入力のみ
+        self.clipboard = None
+        if paste_threshold > 0:
+            try:
+                import pyperclip
+
+                self.clipboard = pyperclip
+            except ImportError:
+                self.logger.warning("pyperclip is not installed, falling back to typing every character")
+
+        # 今の発話で打ち込み済みの文字
+        self.typed = ""
+
+        self.operations: "queue.Queue[Optional[Tuple[str, str, bool]]]" = queue.Queue()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        キューに残っている入力をすべて打ち込んでから止める
+        """
+        self.operations.put(None)
+        self.thread.join()
+
+    def type_text(self, text: str) -> None:
+        """
+        確定したテキストを打ち込む
+        """
+        self.operations.put(("append", text, True))
+
+    def show(self, event: TranscriptEvent) -> None:
+        """
+        ストリーミングの結果を打ち込む
+        """
+        if self.revise:
+            self.operations.put(("set", event.utterance, event.final))
+        elif event.kind == "committed":
+            # 入力済みの文字は取り消さないため、確定したテキストのみ入力する
+            self.operations.put(("append", event.text, True))
+
+    def __drain(self, first) -> Tuple[List[Tuple[str, str, bool]], bool]:
+        operations = [first]
+        while True:
+            try:
+                operation = self.operations.get_nowait()
+            except queue.Empty:
+                return operations, False
+            if operation is None:
+                return operations, True
+            operations.append(operation)
+
+    @staticmethod
+    def _coalesce(operations: List[Tuple[str, str, bool]]) -> List[Tuple[str, str, bool]]:
+        merged = []
+        for kind, text, final in operations:
+            if merged:
+                last_kind, last_text, last_final = merged[-1]
+                # 同じ発話の途中経過は最新のものだけでよい
+                if kind == "set" and last_kind == "set" and not last_final:
+                    merged[-1] = (kind, text, final)
+                    continue
+                if kind == "append" and last_kind == "append":
+                    merged[-1] = (kind, last_text + text, True)
+                    continue
+            merged.append((kind, text, final))
+        return merged
+
+    def __run(self) -> None:
+        while True:
+            first = self.operations.get()
+            if first is None:
+                return
+
+            operations, stopping = self.__drain(first)
+            for kind, text, final in self._coalesce(operations):
+                try:
+                    if kind == "append":
+                        self.__emit(text)
+                    else:
+                        self.__replace(text, final)
+                except Exception as e:
+                    self.logger.warning(f"Failed to type dictation: {e}")
+            if stopping:
+                return
+
+    def __replace(self, utterance: str, final: bool) -> None:
+        prefix = os.path.commonprefix([self.typed, utterance])
+        self.__backspace(len(self.typed) - len(prefix))
+        self.__emit(utterance[len(prefix):])
+        # 発話が終わったら打ち込んだ文字は確定し、次の発話はその後ろに続ける
+        self.typed = "" if final else utterance
+
+    def __backspace(self, count: int) -> None:
+        from pynput.keyboard import Key
+
+        for _ in range(count):
+            self.keyboard.press(Key.backspace)
+            self.keyboard.release(Key.backspace)
+
+    def __emit(self, text: str) -> None:
+        if not text:
+            return
+        if self.clipboard is not None and len(text) >= self.paste_threshold:
+            self.__paste(text)
+        else:
+            self.keyboard.type(text)
+
+    def __paste(self, text: str) -> None:
+        from pynput.keyboard import Key
+
+        previous = self.clipboard.paste()
+        self.clipboard.copy(text)
+
+        modifier = Key.cmd if platform.system() == "Darwin" else Key.ctrl
+        with self.keyboard.pressed(modifier):
+            self.keyboard.press("v")
+            self.keyboard.release("v")
+
+        # 貼り付けが終わる前に戻すと元の内容が貼り付けられるため、少し待ってから戻す
+        time.sleep(0.05)
+        self.clipboard.copy(previous)
@@ -1,21 +1,29 @@
+from typing import List
+
 import numpy as np
 import torch
 from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
 
+from backends import ASRBackend, Result
+
+
+class DistilWhisper(ASRBackend):
+    # distil-whisper/distil-large-v2のみ
+    model_selectable = False
+    supports_batching = True
 
-class DistilWhisper:
-    def __init__(self) -> None:
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    def load(self) -> None:
+        device = self.device if torch.cuda.is_available() else "cpu"
         torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
 
         model_id = "distil-whisper/distil-large-v2"
 
         model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            model_id, torch_dtype=torch_dtype, use_safetensors=True, cache_dir="./cache"
+            model_id, torch_dtype=torch_dtype, use_safetensors=True, cache_dir=self.model_root
         )
         model.to(device)
 
-        processor = AutoProcessor.from_pretrained(model_id, cache_dir="./cache")
+        processor = AutoProcessor.from_pretrained(model_id, cache_dir=self.model_root)
 
         self.pipe = pipeline(
             "automatic-speech-recognition",
@@ -27,10 +35,10 @@ class DistilWhisper:
             device=device,
         )
 
-    def __preprocess(self, data):
-        return np.frombuffer(data, np.int16).flatten().astype(np.float32) / 32768.0
-
-    def transcribe(self, audio_data):
-        audio_data = self.__preprocess(audio_data)
+    def transcribe(self, audio_data: np.ndarray) -> Result:
         result = self.pipe(audio_data)
-        return result
+        return Result(text=result["text"], raw=result)
+
+    def transcribe_batch(self, audio_list: List[np.ndarray]) -> List[Result]:
+        results = self.pipe(list(audio_list), batch_size=len(audio_list))
+        return [Result(text=result["text"], raw=result) for result in results]
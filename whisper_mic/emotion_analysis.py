@@ -1,27 +1,33 @@
-import csv
 import json
+from typing import List, Tuple
 
 import ginza
 import spacy
-import textdistance
+
+from emotion_lexicon import DEFAULT_LEXICON_DIR, load_lexicon
+from utils import get_logger
 
 
 class EmotionAnalyzer:
-    def __init__(self) -> None:
-        self.emotion_annotation_dict = {}
-        self.emotion_category_dict = {}
-
-        with open("./var/emotion_annotation.csv", "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            for annotation in reader:
-                self.emotion_annotation_dict[annotation[0]] = annotation[2]
-
-        with open("./var/emotion_category.csv", "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            for category in reader:
-                self.emotion_category_dict[category[1]] = {"detail": category[0], "aggregate": category[2]}
+    def __init__(self, lexicon_dir: str = DEFAULT_LEXICON_DIR, tokenizer: str = "fast", debug: bool = False) -> None:
+        """
+        Args:
+            lexicon_dir (str): 感情語辞書のCSVを置いたディレクトリ
+            tokenizer (str): "fast"ならトークナイザ(形態素解析)のみ、"full"ならginzaの全パイプラインを通す
+            debug (bool): 解析結果をjsonで出力する
+        """
+        if tokenizer not in ("fast", "full"):
+            raise ValueError(f"Unknown tokenizer: {tokenizer}")
+
+        self.tokenizer = tokenizer
+        self.debug = debug
+        self.logger = get_logger("whisper_mic.emotion", "debug" if debug else "info")
+
+        # CSVから構築した辞書とインデックスはキャッシュから読み込む
+        lexicon = load_lexicon(lexicon_dir)
+        self.emotion_annotation_dict = lexicon["emotion_annotation_dict"]
+        self.emotion_category_dict = lexicon["emotion_category_dict"]
+        self.emotion_index = lexicon["emotion_index"]
 
         self.nlp = spacy.load("ja_ginza")
         ginza.set_split_mode(self.nlp, "C")
@@ -60,51 +66,60 @@ class EmotionAnalyzer:
 
         return wakati_with_tag_list
 
+    def _tokenize(self, text) -> List[Tuple[str, str]]:
+        """
+        分かち書きした各トークンの正規化形と品詞のみを返す
+
+        Returns:
+            List[Tuple[str, str]]: (norm_, tag_) のリスト
+        """
+        if self.tokenizer == "fast":
+            # 係り受け解析や固有表現抽出は使わないため、形態素解析のみ行う
+            doc = self.nlp.tokenizer(text)
+        else:
+            doc = self.nlp(text)
+
+        return [(token.norm_, token.tag_) for token in doc]
+
     def extract_emotion(self, text):
         """
         analyzerの解析結果を基に、感情を特定
         """
 
-        # analyzerで解析
-        result = self._wakati_with_tag(text)
-        print(json.dumps(result, indent=4, ensure_ascii=False))
+        if self.debug:
+            self.logger.debug(json.dumps(self._wakati_with_tag(text), indent=4, ensure_ascii=False))
 
         # テキスト自身も含める
         word_list = [text]
 
-        for key, value in result.items():
-            for item in value.values():
-                if item["tag_"].split("-")[0] not in self.filter_tags:
-                    word_list.append(item["norm_"])
+        for norm, tag in self._tokenize(text):
+            if tag.split("-")[0] not in self.filter_tags:
+                word_list.append(norm)
 
-        print(word_list)
+        if self.debug:
+            self.logger.debug(word_list)
 
         emotion_list = []
         match_word = {"word": None, "emotion_word": None, "similarity": None}
-        rate_dict = {}
-
-        for emotion_word, emotion_tags in self.emotion_annotation_dict.items():
-            for word in word_list:
-                if len(word) > 3:
-                    rate = round(textdistance.cosine.normalized_similarity(word, emotion_word), 8)
-                    rate_dict["->".join([word, emotion_word, emotion_tags])] = rate
-
-                if word == emotion_word:
-                    emotion_tag_list = list(emotion_tags)
-                    match_word["word"] = word
-                    match_word["emotion_word"] = emotion_word
-                    match_word["similarity"] = 1
-
-                    for emotion_tag in emotion_tag_list:
-                        emotion_list.append(self.emotion_category_dict.get(emotion_tag))
-
-                    break
-
-        if not emotion_list and rate_dict.items():
-            max_key, rate = max(rate_dict.items(), key=lambda x: x[1])
-            print(max_key, rate)
 
-            [word, emotion_word, emotion_tags] = max_key.split("->")
+        # 完全一致
+        for i in self.emotion_index.exact(word_list):
+            emotion_word = self.emotion_index.words[i]
+            emotion_tags = self.emotion_annotation_dict[emotion_word]
+            match_word["word"] = emotion_word
+            match_word["emotion_word"] = emotion_word
+            match_word["similarity"] = 1
+
+            for emotion_tag in list(emotion_tags):
+                emotion_list.append(self.emotion_category_dict.get(emotion_tag))
+
+        # 完全一致がなければ4文字以上の語で類似度が最大のものを採用
+        best = None if emotion_list else self.emotion_index.most_similar(word_list)
+        if best is not None:
+            word, i, rate = best
+            emotion_word = self.emotion_index.words[i]
+            emotion_tags = self.emotion_annotation_dict[emotion_word]
+            self.logger.debug(f"{'->'.join([word, emotion_word, emotion_tags])} {rate}")
 
             if rate > 0.8:
                 emotion_tag_list = list(emotion_tags)
@@ -115,6 +130,6 @@ class EmotionAnalyzer:
                 for emotion_tag in emotion_tag_list:
                     emotion_list.append(self.emotion_category_dict.get(emotion_tag))
 
-        print(match_word)
+        self.logger.debug(match_word)
 
         return emotion_list
@@ -0,0 +1,71 @@
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmotionLexiconIndex:
+    """
+    感情語辞書の検索用インデックス
+
+    完全一致はハッシュで引き、類似語は文字単位の転置インデックスから
+    textdistance.cosine(qval=1)と同じ類似度
+    (共通文字数 / sqrt(len(a) * len(b))) を全見出し語に対してまとめて計算する。
+    """
+
+    def __init__(self, words: List[str]) -> None:
+        self.words = list(words)
+        self.positions = {word: i for i, word in enumerate(self.words)}
+        self.lengths = np.array([len(word) for word in self.words], dtype=np.float64)
+        # 空の見出し語は類似度0として扱う
+        self.lengths[self.lengths == 0] = np.inf
+
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, word in enumerate(self.words):
+            for char, count in Counter(word).items():
+                ids, counts = postings.setdefault(char, ([], []))
+                ids.append(i)
+                counts.append(count)
+
+        self.postings = {
+            char: (np.array(ids, dtype=np.int32), np.array(counts, dtype=np.int32))
+            for char, (ids, counts) in postings.items()
+        }
+
+    def exact(self, word_list: List[str]) -> List[int]:
+        """
+        Returns:
+            List[int]: word_listのいずれかと完全一致した見出し語の番号(辞書順)
+        """
+        return sorted({self.positions[word] for word in word_list if word in self.positions})
+
+    def similarity(self, word: str) -> np.ndarray:
+        intersection = np.zeros(len(self.words), dtype=np.float64)
+        for char, count in Counter(word).items():
+            if char in self.postings:
+                ids, counts = self.postings[char]
+                intersection[ids] += np.minimum(counts, count)
+
+        return np.round(intersection / np.sqrt(self.lengths * len(word)), 8)
+
+    def most_similar(self, word_list: List[str], min_length: int = 4) -> Optional[Tuple[str, int, float]]:
+        """
+        min_length文字以上の語について最も類似度の高い見出し語を探す。
+        同率の場合は辞書順で先の見出し語、次にword_listで先の語を優先する
+
+        Returns:
+            Tuple[str, int, float]: (語, 見出し語の番号, 類似度)。対象の語がなければNone
+        """
+        best = None
+        for word in word_list:
+            if len(word) < min_length or not self.words:
+                continue
+
+            rates = self.similarity(word)
+            i = int(np.argmax(rates))
+            rate = float(rates[i])
+
+            if best is None or rate > best[2] or (rate == best[2] and i < best[1]):
+                best = (word, i, rate)
+
+        return best
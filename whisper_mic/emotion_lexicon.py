@@ -0,0 +1,139 @@
+import csv
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Dict, Tuple
+
+from emotion_index import EmotionLexiconIndex
+from utils import get_logger
+
+DEFAULT_LEXICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "var")
+
+ANNOTATION_FILE = "emotion_annotation.csv"
+CATEGORY_FILE = "emotion_category.csv"
+CACHE_FILE = "emotion_lexicon.pkl"
+
+# 辞書やインデックスの形式を変えたら上げる
+CACHE_VERSION = 1
+
+logger = get_logger("whisper_mic.emotion_lexicon", "info")
+
+
+def _file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_csv(annotation_path: str, category_path: str) -> Tuple[Dict[str, str], Dict[str, Dict[str, str]]]:
+    emotion_annotation_dict = {}
+    emotion_category_dict = {}
+
+    with open(annotation_path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for annotation in reader:
+            emotion_annotation_dict[annotation[0]] = annotation[2]
+
+    with open(category_path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        for category in reader:
+            emotion_category_dict[category[1]] = {"detail": category[0], "aggregate": category[2]}
+
+    return emotion_annotation_dict, emotion_category_dict
+
+
+def _is_fresh(cache: dict, sources: Dict[str, str]) -> Tuple[bool, bool]:
+    """
+    Returns:
+        Tuple[bool, bool]: キャッシュが使えるか、内容は同じで更新日時だけ変わったファイルがあったか
+    """
+    if cache.get("version") != CACHE_VERSION:
+        return False, False
+
+    touched = False
+    for name, path in sources.items():
+        stat = os.stat(path)
+        cached = cache["sources"].get(name)
+        if cached is None:
+            return False, False
+        # 更新日時とサイズが同じならハッシュの計算を省く
+        if cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size:
+            continue
+        if cached["sha256"] != _file_hash(path):
+            return False, False
+        cached["mtime"] = stat.st_mtime
+        touched = True
+
+    return True, touched
+
+
+def compile_lexicon(lexicon_dir: str = DEFAULT_LEXICON_DIR, cache_path: str = None) -> dict:
+    """
+    CSVを読み込んで辞書と検索インデックスを構築し、pickleで保存する
+    """
+    sources = {name: os.path.join(lexicon_dir, name) for name in (ANNOTATION_FILE, CATEGORY_FILE)}
+    cache_path = cache_path or os.path.join(lexicon_dir, CACHE_FILE)
+
+    emotion_annotation_dict, emotion_category_dict = _read_csv(sources[ANNOTATION_FILE], sources[CATEGORY_FILE])
+    cache = {
+        "version": CACHE_VERSION,
+        "sources": {},
+        "emotion_annotation_dict": emotion_annotation_dict,
+        "emotion_category_dict": emotion_category_dict,
+        "emotion_index": EmotionLexiconIndex(list(emotion_annotation_dict)),
+    }
+    for name, path in sources.items():
+        stat = os.stat(path)
+        cache["sources"][name] = {"sha256": _file_hash(path), "mtime": stat.st_mtime, "size": stat.st_size}
+
+    _write_cache(cache, cache_path)
+    return cache
+
+
+def _write_cache(cache: dict, cache_path: str) -> None:
+    # 書き込み途中のファイルを他のプロセスが読まないよう、一時ファイルから置き換える
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write lexicon cache {cache_path}: {e}")
+
+
+def load_lexicon(lexicon_dir: str = DEFAULT_LEXICON_DIR, cache_path: str = None) -> dict:
+    """
+    キャッシュが元のCSVと一致していればそれを使い、古ければ再構築する
+
+    Returns:
+        dict: emotion_annotation_dict, emotion_category_dict, emotion_index を含む辞書
+    """
+    sources = {name: os.path.join(lexicon_dir, name) for name in (ANNOTATION_FILE, CATEGORY_FILE)}
+    cache_path = cache_path or os.path.join(lexicon_dir, CACHE_FILE)
+
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        fresh, touched = _is_fresh(cache, sources)
+        if fresh:
+            # 次回の起動でハッシュを計算し直さないよう、新しい更新日時を保存する
+            if touched:
+                _write_cache(cache, cache_path)
+            return cache
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, KeyError):
+        pass
+
+    logger.info(f"Compiling emotion lexicon from {lexicon_dir}")
+    return compile_lexicon(lexicon_dir, cache_path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lexicon_dir", default=DEFAULT_LEXICON_DIR, help="Directory containing the emotion CSV files")
+    args = parser.parse_args()
+
+    compile_lexicon(args.lexicon_dir)
@@ -0,0 +1,53 @@
+import threading
+from typing import Any, Callable, Dict
+
+from pythonosc import dispatcher, osc_server
+
+from osc_scheduler import BLINK_ADDRESS, EMOTE_ADDRESS, OSCScheduler
+from utils import get_logger
+
+
+class ExpressionService:
+    """
+    VRChatから届くOSCを受け取り、アバター側での表情の変化をOSCSchedulerに伝える
+
+    表情を平常に戻すのはOSCSchedulerの送信スレッドが期限の時刻に行うため、ポーリングはしない。
+    受け取るアドレスはhandlersに登録したものだけで、それ以外のメッセージは無視する。
+    """
+
+    def __init__(self, scheduler: OSCScheduler, ip: str = "127.0.0.1", port: int = 9001) -> None:
+        self.logger = get_logger("whisper_mic.expression", "info")
+        self.scheduler = scheduler
+        self.address = (ip, port)
+
+        self.handlers: Dict[str, Callable[[str, Any], None]] = {
+            EMOTE_ADDRESS: self.__on_emote,
+            BLINK_ADDRESS: self.__on_parameter,
+        }
+        self.dispatcher = dispatcher.Dispatcher()
+        for address, handler in self.handlers.items():
+            self.dispatcher.map(address, handler)
+
+        self.server = None
+        self.thread = None
+
+    def start(self) -> None:
+        self.server = osc_server.BlockingOSCUDPServer(self.address, self.dispatcher)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.logger.info(f"Listening for OSC on {self.server.server_address}")
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def __on_emote(self, address: str, *args) -> None:
+        if args:
+            self.scheduler.observe(address, int(args[0]))
+
+    def __on_parameter(self, address: str, *args) -> None:
+        if args:
+            self.scheduler.observe(address, args[0])
@@ -1,23 +1,48 @@
 import numpy as np
-import torch
 from faster_whisper import WhisperModel
 
+from backends import ASRBackend, Result
 
-class FasterWhisper:
-    def __init__(self) -> None:
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
 
-        model_size = "large-v2"
+class FasterWhisper(ASRBackend):
+    """
+    CTranslate2によるWhisper。CPUでは既定でint8に量子化したモデルで推論する
+    """
 
-        self.model = WhisperModel(model_size, device="cuda:0", compute_type="float16", download_root="./cache")
+    supports_word_timestamps = True
+    # CTranslate2の精度はそのまま渡す
+    compute_types = None
 
-    def __preprocess(self, data):
-        return np.frombuffer(data, np.int16).flatten().astype(np.float32) / 32768.0
+    def load(self) -> None:
+        if self.on_gpu:
+            device, compute_type = "cuda", "float16"
+        else:
+            device, compute_type = "cpu", "int8"
+        if self.compute_type != "default":
+            compute_type = self.compute_type
 
-    def transcribe(self, audio_data):
-        audio_data = self.__preprocess(audio_data)
-        segments, info = self.model.transcribe(audio_data, beam_size=5, language="ja")
+        self.audio_model = WhisperModel(
+            self.model,
+            device=device,
+            compute_type=compute_type,
+            cpu_threads=self.cpu_threads,
+            num_workers=self.num_workers,
+            download_root=self.model_root,
+        )
 
-        for segment in segments:
-            print("[%.2fs -> %.2fs] %s" % (segment.start, segment.end, segment.text))
+    def transcribe(self, audio_data: np.ndarray) -> Result:
+        language = "en" if self.english else "ja"
+        segments, info = self.audio_model.transcribe(
+            audio_data,
+            beam_size=self.beam_size,
+            temperature=self.temperature,
+            language=language,
+            word_timestamps=self.word_timestamps,
+        )
+        segments = list(segments)
+
+        words = None
+        if self.word_timestamps:
+            words = [(word.word, word.end) for segment in segments for word in segment.words or []]
+        text = "".join(segment.text for segment in segments)
+        return Result(text=text, raw={"segments": segments, "info": info}, words=words)
@@ -1,13 +1,23 @@
+from typing import List
+
 import numpy as np
 import torch
-import librosa
 
 from transformers import Wav2Vec2FeatureExtractor, HubertForSequenceClassification, Wav2Vec2ForSequenceClassification
 
+from backends import ASRBackend, Result
+
+
+class Hubert(ASRBackend):
+    """
+    音声から感情ラベルを推定する。textには推定したラベルが入る
+    """
 
-class Hubert:
-    def __init__(self) -> None:
-        self.device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    model_selectable = False
+    supports_batching = True
+
+    def load(self) -> None:
+        self.torch_device = self.device if torch.cuda.is_available() else "cpu"
 
         model_name = "Bagus/wav2vec2-xlsr-japanese-speech-emotion-recognition"
         # model_name = 'Rajaram1996/Hubert_emotion'
@@ -16,25 +26,31 @@ class Hubert:
         feature_extractor_name = model_name
         # feature_extractor_name = "facebook/hubert-base-ls960"
 
-        self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(feature_extractor_name, cache_dir="./cache")
-        self.model = HubertForSequenceClassification.from_pretrained(model_name, cache_dir="./cache").to(self.device)
-        # self.model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name, cache_dir="./cache").to(self.device)
-        self.feature_extractor
-        self.model.eval()
-
-    def __preprocess(self, data):
-        return np.frombuffer(data, np.int16).flatten().astype(np.float32) / 32768.0
+        self.feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(feature_extractor_name, cache_dir=self.model_root)
+        self.audio_model = HubertForSequenceClassification.from_pretrained(model_name, cache_dir=self.model_root).to(
+            self.torch_device
+        )
+        # self.audio_model = Wav2Vec2ForSequenceClassification.from_pretrained(model_name, cache_dir=self.model_root).to(self.torch_device)
+        self.audio_model.eval()
 
-    def transcribe(self, audio_data):
-        audio_data = self.__preprocess(audio_data)
-        # print(audio_data.shape[0])
-        # audio_data = librosa.resample(audio_data, audio_data.shape[0], 16_000)
-        # print(audio_data.shape[0])
+    def transcribe(self, audio_data: np.ndarray) -> Result:
         inputs = self.feature_extractor(audio_data, return_tensors="pt", sampling_rate=16000, padding=True).to(
-            self.device
+            self.torch_device
+        )
+        with torch.no_grad():
+            logits = self.audio_model(**inputs).logits
+        predicted_class_ids = torch.argmax(logits, dim=-1)
+        predicted_label = self.audio_model.config.id2label[predicted_class_ids.item()]
+        return Result(text=predicted_label, raw=logits)
+
+    def transcribe_batch(self, audio_list: List[np.ndarray]) -> List[Result]:
+        inputs = self.feature_extractor(list(audio_list), return_tensors="pt", sampling_rate=16000, padding=True).to(
+            self.torch_device
         )
         with torch.no_grad():
-            logits = self.model(**inputs).logits
+            logits = self.audio_model(**inputs).logits
         predicted_class_ids = torch.argmax(logits, dim=-1)
-        predicted_label = self.model.config.id2label[predicted_class_ids.item()]
-        print(predicted_label)
+        return [
+            Result(text=self.audio_model.config.id2label[class_id.item()], raw=row)
+            for class_id, row in zip(predicted_class_ids, logits)
+        ]
@@ -0,0 +1,203 @@
+"""
+処理の遅れを調べるためのカウンタ・ゲージ・ヒストグラム
+
+各モジュールはモジュール共通のREGISTRYに値を記録し、
+start_http_server()でPrometheusのテキスト形式で公開する。
+
+    curl http://127.0.0.1:9464/metrics
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+
+# 音声1区間あたりの秒数を想定したヒストグラムの区切り
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str = "") -> None:
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str = "") -> None:
+        super().__init__(name, help)
+        self.values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(_label_key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[_label_key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str = "", buckets=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+        # ラベルごとに [各区切りの件数..., +Infの件数], 合計, 件数
+        self.values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+        # ベンチマークなどで区切りに丸める前の値を受け取る関数
+        self.listeners: List[Callable[[float, Dict[str, str]], None]] = []
+
+    def add_listener(self, listener: Callable[[float, Dict[str, str]], None]) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[float, Dict[str, str]], None]) -> None:
+        self.listeners.remove(listener)
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            counts, total = self.values[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            total[0] += value
+            total[1] += 1
+
+        for listener in self.listeners:
+            listener(value, labels)
+
+    def count(self, **labels) -> int:
+        value = self.values.get(_label_key(labels))
+        return 0 if value is None else value[1][1]
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    bucket_labels = _format_labels(key, 'le="' + le + '"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total[0]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {total[1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def __get_or_create(self, cls, name: str, help: str, **kwargs) -> Metric:
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        return self.__get_or_create(Counter, name, help)
+
+    def gauge(self, name: str, help: str = "") -> Gauge:
+        return self.__get_or_create(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.__get_or_create(Histogram, name, help, buckets=buckets)
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+AUDIO_QUEUE_SECONDS = REGISTRY.gauge("whisper_mic_audio_queue_seconds", "Seconds of captured audio waiting to be transcribed")
+SEGMENT_SECONDS = REGISTRY.histogram("whisper_mic_segment_seconds", "Duration of each decoded speech segment")
+DECODE_SECONDS = REGISTRY.histogram("whisper_mic_decode_seconds", "Wall time spent in the ASR backend per segment")
+REAL_TIME_FACTOR = REGISTRY.histogram(
+    "whisper_mic_real_time_factor",
+    "Decode time divided by segment duration (above 1 means falling behind)",
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0),
+)
+ANALYSIS_SECONDS = REGISTRY.histogram("whisper_mic_analysis_seconds", "Wall time per analysis stage (emotion, sentiment, osc_update)")
+STAGE_SECONDS = REGISTRY.histogram(
+    "whisper_mic_stage_seconds",
+    "Wall time per pipeline stage (read, segment, queue_wait, preprocess, decode, osc_send)",
+)
+OSC_MESSAGES = REGISTRY.counter("whisper_mic_osc_messages_total", "OSC messages sent to VRChat")
+DROPPED_SEGMENTS = REGISTRY.counter("whisper_mic_dropped_segments_total", "Segments or texts discarded before processing, by reason")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        # アクセスごとに標準エラーへ出力しない
+        pass
+
+
+def start_http_server(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """
+    メトリクスを返すHTTPサーバーをデーモンスレッドで起動する
+
+    Returns:
+        ThreadingHTTPServer: 止める場合はshutdown()を呼ぶ
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,418 @@
+"""
+音声の取り込み・音声認識・感情解析をそれぞれ別のプロセスで動かす
+
+    取り込み --(共有メモリのリングバッファ + 区間の位置のキュー)--> 音声認識 --(テキストのキュー)--> 感情解析
+                                                                           \\--(結果のキュー)--> 親プロセス
+
+GILを取り合わないため、形態素解析やBERTの推論中でも取り込みが遅れない。
+親プロセスは子プロセスを監視し、異常終了した場合は作り直す。
+"""
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from metrics import REGISTRY
+from utils import configure_cpu, get_logger
+
+CAPTURE = "capture"
+ASR = "asr"
+ANALYSIS = "analysis"
+
+BANNED_RESULTS = ["", " ", "\n", None]
+
+PROCESS_RESTARTS = REGISTRY.counter("whisper_mic_process_restarts_total", "Worker processes restarted after a crash, by stage")
+
+
+class SharedRingBuffer:
+    """
+    1つの書き込み側と1つの読み出し側で共有する、int16の発話区間のリングバッファ
+
+    区間は必ず連続した領域に書き込むので、読み出し側はコピーせずにビューで読める。
+    書き込み位置と読み出し位置はサンプル数の累計として共有メモリの先頭に置く。
+    """
+
+    HEADER = 24  # 書き込み位置, 読み出し位置, 容量(いずれもuint64)
+
+    def __init__(self, capacity: int = 0, name: Optional[str] = None) -> None:
+        """
+        Args:
+            capacity (int): サンプル数。nameを指定しない場合に新しく作る大きさ
+            name (str): 既存の共有メモリの名前。子プロセスから開く場合に指定する
+        """
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.HEADER + capacity * 2)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray(3, dtype=np.uint64, buffer=self.shm.buf[:self.HEADER])
+        if self.owner:
+            self.header[:] = (0, 0, capacity)
+        self.capacity = int(self.header[2])
+        self.data = np.ndarray(self.capacity, dtype=np.int16, buffer=self.shm.buf[self.HEADER:])
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, samples: np.ndarray) -> Optional[Tuple[int, int]]:
+        """
+        Returns:
+            Tuple[int, int]: 書き込んだ (開始位置, サンプル数)。空きが足りなければNone
+        """
+        n = samples.shape[0]
+        write, read = int(self.header[0]), int(self.header[1])
+
+        # 末尾に収まらない場合は先頭から書く
+        position = write % self.capacity
+        if position + n > self.capacity:
+            write += self.capacity - position
+            position = 0
+        if write + n - read > self.capacity:
+            return None
+
+        self.data[position:position + n] = samples
+        self.header[0] = write + n
+        return write, n
+
+    def view(self, start: int, length: int) -> np.ndarray:
+        position = start % self.capacity
+        return self.data[position:position + length]
+
+    def release(self, start: int, length: int) -> None:
+        # 区間は書き込んだ順に読むので、読み終えた区間の終わりまでを空ける
+        self.header[1] = start + length
+
+    def close(self) -> None:
+        # ビューが残っているとclose()できない
+        self.header = None
+        self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _put_latest(q, item) -> None:
+    # 受け取り側が遅れている場合は一番古い結果を捨てる。古い結果より新しい結果を優先する
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _init_worker(threads: int = 0, affinity: Optional[str] = None) -> None:
+    # Ctrl+Cは親プロセスが受けて、stopで順に止める
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_cpu(threads, affinity=affinity)
+
+
+def _capture_main(ring_name, segments, stop, options: dict) -> None:
+    from audio_source import MicrophoneSource, create_source
+    from vad import EnergyVAD, VADSegmenter
+
+    _init_worker(affinity=options["affinity"])
+    logger = get_logger("whisper_mic.capture", "info")
+    ring = SharedRingBuffer(name=ring_name)
+
+    energy = options["energy"]
+    if options["source"] is None:
+        import speech_recognition as sr
+
+        microphone = sr.Microphone(sample_rate=16000, device_index=options["mic_index"])
+        recorder = sr.Recognizer()
+        recorder.energy_threshold = energy
+        with microphone:
+            recorder.adjust_for_ambient_noise(microphone)
+        energy = recorder.energy_threshold
+        source = MicrophoneSource(microphone)
+    else:
+        source = create_source(options["source"], realtime=options["realtime"])
+
+    segmenter = VADSegmenter(
+        EnergyVAD(energy=energy, dynamic_energy=options["dynamic_energy"]),
+        pre_roll=options["pre_roll"],
+        hangover=options["pause"],
+    )
+
+    def send(segment) -> None:
+        if segment is None:
+            return
+        written = ring.write(segment)
+        if written is None:
+            logger.warning("Audio ring buffer is full, dropping a segment")
+            return
+        segments.put(written)
+
+    try:
+        with source:
+            while not stop.is_set():
+                data = source.read()
+                if data is None:
+                    break
+                for segment in segmenter.process(data):
+                    send(segment)
+            send(segmenter.flush())
+
+        # 入力が終わったことを知らせる
+        if not stop.is_set():
+            segments.put(None)
+    finally:
+        ring.close()
+
+
+def _asr_main(ring_name, segments, texts, results, stop, options: dict) -> None:
+    from audio_convert import CONVERTER
+    from backends import create_backend
+    from utils import get_default_device
+
+    _init_worker(options["backend_options"].get("cpu_threads", 0), options["affinity"])
+    ring = SharedRingBuffer(name=ring_name)
+
+    backend = create_backend(
+        options["backend"],
+        model=options["model"],
+        device=options["device"] or get_default_device(),
+        english=options["english"],
+        model_root=options["model_root"],
+        **options["backend_options"],
+    )
+    backend.load()
+
+    try:
+        while not stop.is_set():
+            try:
+                item = segments.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if item is None:
+                results.put(None)
+                if texts is not None:
+                    texts.put(None)
+                break
+
+            start, length = item
+            audio_data = CONVERTER.convert(ring.view(start, length))
+            ring.release(start, length)
+
+            text = backend.transcribe(audio_data).text
+            if text in BANNED_RESULTS:
+                continue
+            _put_latest(results, text)
+            if texts is not None:
+                _put_latest(texts, text)
+    finally:
+        ring.close()
+
+
+def _analysis_main(texts, stop, options: dict) -> None:
+    from analysis_pipeline import SENT_FILTERED, AnalysisPipeline
+    from emotion_analysis import EmotionAnalyzer
+    from sentiment_analysis import SentimentAnalyzer
+    from vrchat_manager import VRChatManager
+
+    _init_worker(affinity=options["affinity"])
+
+    if options["lexicon_dir"] is None:
+        emotion_analyzer = EmotionAnalyzer()
+    else:
+        emotion_analyzer = EmotionAnalyzer(options["lexicon_dir"])
+    pipeline = AnalysisPipeline(
+        emotion_analyzer,
+        SentimentAnalyzer(),
+        VRChatManager(min_interval=options["osc_interval"], reset_after=options["expression_reset"]),
+        vrchat=options["vrchat"],
+        sent_filtered=SENT_FILTERED,
+    )
+    pipeline.start()
+
+    try:
+        while not stop.is_set():
+            try:
+                text = texts.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if text is None:
+                break
+            pipeline.submit(text)
+    finally:
+        pipeline.stop()
+
+
+class MultiProcessMic:
+    """
+    取り込み・音声認識・感情解析の3つのプロセスを起動して監視する
+
+    Example:
+        mic = MultiProcessMic(backend="faster_whisper", model="small", affinity={"capture": "0", "asr": "1-3"})
+        mic.listen_loop()
+    """
+
+    def __init__(
+        self,
+        model="base",
+        device=None,
+        english=False,
+        backend="nue_asr",
+        backend_options=None,
+        model_root="./cache",
+        energy=300,
+        pause=0.8,
+        dynamic_energy=False,
+        pre_roll=0.3,
+        mic_index=None,
+        source=None,
+        realtime=True,
+        analysis=True,
+        vrchat=False,
+        lexicon_dir=None,
+        osc_interval=0.2,
+        expression_reset=15.0,
+        affinity: Optional[Dict[str, str]] = None,
+        ring_seconds: float = 60,
+        max_restarts: int = 5,
+    ) -> None:
+        """
+        Args:
+            affinity (Dict[str, str]): "capture", "asr", "analysis" ごとに割り当てるCPU("0-3,6"の形式)
+            ring_seconds (float): 取り込みと音声認識の間で溜められる音声の秒数
+            max_restarts (int): プロセスごとに作り直す回数の上限
+        """
+        self.logger = get_logger("whisper_mic.multiprocess", "info")
+        self.context = multiprocessing.get_context("spawn")
+        affinity = affinity or {}
+
+        self.options = {
+            CAPTURE: dict(
+                affinity=affinity.get(CAPTURE),
+                source=source,
+                realtime=realtime,
+                mic_index=mic_index,
+                energy=energy,
+                pause=pause,
+                dynamic_energy=dynamic_energy,
+                pre_roll=pre_roll,
+            ),
+            ASR: dict(
+                affinity=affinity.get(ASR),
+                backend=backend,
+                model=model,
+                device=device,
+                english=english,
+                model_root=model_root,
+                backend_options=backend_options or {},
+            ),
+            ANALYSIS: dict(
+                affinity=affinity.get(ANALYSIS),
+                vrchat=vrchat,
+                lexicon_dir=lexicon_dir,
+                osc_interval=osc_interval,
+                expression_reset=expression_reset,
+            ),
+        }
+        self.analysis = analysis
+        self.max_restarts = max_restarts
+
+        self.ring = SharedRingBuffer(int(ring_seconds * 16000))
+        self.segments = self.context.Queue()
+        self.texts = self.context.Queue(maxsize=32) if analysis else None
+        self.results = self.context.Queue(maxsize=32)
+        self.stop_event = self.context.Event()
+
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        self.restarts = {CAPTURE: 0, ASR: 0, ANALYSIS: 0}
+        self.supervisor = None
+        self.stopping = False
+
+    def __spawn(self, stage: str) -> None:
+        if stage == CAPTURE:
+            args = (self.ring.name, self.segments, self.stop_event, self.options[CAPTURE])
+            target = _capture_main
+        elif stage == ASR:
+            args = (self.ring.name, self.segments, self.texts, self.results, self.stop_event, self.options[ASR])
+            target = _asr_main
+        else:
+            args = (self.texts, self.stop_event, self.options[ANALYSIS])
+            target = _analysis_main
+
+        process = self.context.Process(target=target, args=args, name=f"whisper_mic-{stage}", daemon=True)
+        process.start()
+        self.processes[stage] = process
+
+    def start(self) -> None:
+        stages = [CAPTURE, ASR] + ([ANALYSIS] if self.analysis else [])
+        for stage in stages:
+            self.__spawn(stage)
+        self.supervisor = threading.Thread(target=self.__supervise, daemon=True)
+        self.supervisor.start()
+
+    def __supervise(self) -> None:
+        while not self.stopping:
+            time.sleep(0.5)
+            for stage, process in list(self.processes.items()):
+                # 正常終了(入力の終わり)は作り直さない
+                if self.stopping or process.is_alive() or process.exitcode == 0:
+                    continue
+
+                if self.restarts[stage] >= self.max_restarts:
+                    self.logger.error(f"{stage} process exited with {process.exitcode}, giving up after {self.max_restarts} restarts")
+                    self.results.put(None)
+                    return
+
+                self.restarts[stage] += 1
+                PROCESS_RESTARTS.inc(stage=stage)
+                self.logger.warning(
+                    f"{stage} process exited with {process.exitcode}, restarting ({self.restarts[stage]}/{self.max_restarts})"
+                )
+                # 起動直後に落ち続ける場合に備えて、作り直すたびに待ち時間を延ばす
+                time.sleep(min(2 ** self.restarts[stage] * 0.5, 10))
+                self.__spawn(stage)
+
+    def stop(self) -> None:
+        self.stopping = True
+        self.stop_event.set()
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.ring.close()
+
+    def listen_loop(self, dictate: bool = False, paste_threshold: int = 16) -> None:
+        if not self.processes:
+            self.start()
+
+        dictation = None
+        if dictate:
+            from dictation import DictationSink
+
+            dictation = DictationSink(paste_threshold=paste_threshold)
+            dictation.start()
+
+        self.logger.info("Listening...")
+        try:
+            while True:
+                result = self.results.get()
+                # 入力元が終わった
+                if result is None:
+                    break
+                if dictation is not None:
+                    dictation.type_text(result)
+                else:
+                    print(result)
+        except KeyboardInterrupt:
+            self.logger.info("Stopping...")
+        finally:
+            self.stop()
+            if dictation is not None:
+                dictation.stop()
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List
+
+from utils import get_logger
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg")
+
+logger = get_logger("whisper_mic.offline", "info")
+
+# ワーカープロセスごとに1つだけ持つモデル
+_mic = None
+
+
+def _init_worker(options: dict) -> None:
+    global _mic
+    from whisper_mic import WhisperMic
+
+    _mic = WhisperMic(use_mic=False, analysis=False, **options)
+
+
+def _transcribe_file(path: str) -> List[dict]:
+    return _mic.transcribe_file(path)
+
+
+def expand_paths(paths: List[str]) -> List[str]:
+    """
+    ディレクトリは再帰的にたどり、音声ファイルの一覧にする
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+
+        for root, _, names in os.walk(path):
+            for name in sorted(names):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append(os.path.join(root, name))
+
+    return files
+
+
+def transcribe_files(paths: List[str], output: str = None, workers: int = 1, **options) -> int:
+    """
+    音声ファイルを文字起こしし、発話区間ごとに1行のJSONLで書き出す
+
+    workersが2以上ならファイル単位でプロセスプールに振り分け、各プロセスがモデルを読み込む。
+
+    Returns:
+        int: 失敗したファイルの数
+    """
+    files = expand_paths(paths)
+    out = open(output, "w", encoding="utf-8") if output else sys.stdout
+    failed = 0
+
+    def write(path, future_or_results) -> None:
+        nonlocal failed
+        try:
+            results = future_or_results() if callable(future_or_results) else future_or_results
+        except Exception as e:
+            logger.warning(f"Failed to transcribe {path}: {e}")
+            out.write(json.dumps({"path": path, "error": str(e)}, ensure_ascii=False) + "\n")
+            failed += 1
+            return
+
+        for result in results:
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    try:
+        if workers <= 1:
+            _init_worker(options)
+            for path in files:
+                write(path, lambda: _transcribe_file(path))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(options,)) as executor:
+                futures = {executor.submit(_transcribe_file, path): path for path in files}
+                for future in as_completed(futures):
+                    write(futures[future], future.result)
+    finally:
+        if output:
+            out.close()
+
+    return failed
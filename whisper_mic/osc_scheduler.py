@@ -0,0 +1,144 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from pythonosc.osc_bundle_builder import IMMEDIATELY, OscBundleBuilder
+from pythonosc.osc_message_builder import OscMessageBuilder
+
+from metrics import OSC_MESSAGES, REGISTRY, STAGE_SECONDS
+from utils import get_logger
+
+EMOTE_ADDRESS = "/avatar/parameters/FaceEmo_SYNC_EM_EMOTE"
+BLINK_ADDRESS = "/avatar/parameters/FaceEmo_CN_BLINK_ENABLE"
+
+OSC_BUNDLES = REGISTRY.counter("whisper_mic_osc_bundles_total", "OSC bundles sent to VRChat")
+OSC_SUPPRESSED = REGISTRY.counter("whisper_mic_osc_suppressed_total", "OSC parameter writes skipped because the value was unchanged")
+
+
+class OSCScheduler:
+    """
+    アバターのパラメータ送信をまとめ、変化した値だけを間隔を空けて送る
+
+    updateで渡した値は最後に送った値と比べ、変わったものだけを次の送信に回す。
+    送信はmin_interval秒に1回までで、その間に届いた更新は最新の値にまとめて1つのOSCバンドルで送る。
+    表情を平常以外にした場合はreset_after秒後に平常(neutral)に戻す。
+    """
+
+    def __init__(self, client, min_interval: float = 0.2, reset_after: Optional[float] = 15.0, neutral: int = 0) -> None:
+        """
+        Args:
+            client: pythonosc.udp_client.SimpleUDPClient
+            min_interval (float): 送信の最小間隔(秒)
+            reset_after (float): 表情を平常に戻すまでの秒数。Noneなら戻さない
+            neutral (int): 平常の表情番号
+        """
+        self.logger = get_logger("whisper_mic.osc", "info")
+        self.client = client
+        self.min_interval = min_interval
+        self.reset_after = reset_after
+        self.neutral = neutral
+
+        self.last_sent: Dict[str, Any] = {}
+        self.pending: Dict[str, Any] = {}
+        self.last_send_time = float("-inf")
+        self.reset_deadline: Optional[float] = None
+
+        self.cond = threading.Condition()
+        self.break_threads = False
+        self.thread = threading.Thread(target=self.__send_forever, daemon=True)
+        self.thread.start()
+
+    def update(self, params: Dict[str, Any]) -> None:
+        """
+        Args:
+            params (Dict[str, Any]): OSCアドレスと値
+        """
+        with self.cond:
+            for address, value in params.items():
+                if address not in self.pending and self.last_sent.get(address) == value:
+                    OSC_SUPPRESSED.inc()
+                    continue
+                self.pending[address] = value
+            self.cond.notify()
+
+    def observe(self, address: str, value: Any) -> None:
+        """
+        アバター側で変わった値を記録する。表情が変わった場合は平常に戻す時刻も決め直す
+        """
+        with self.cond:
+            self.last_sent[address] = value
+            if address == EMOTE_ADDRESS:
+                self.__schedule_reset(value, time.monotonic())
+            self.cond.notify()
+
+    def stop(self) -> None:
+        with self.cond:
+            self.break_threads = True
+            self.cond.notify()
+        self.thread.join()
+
+    def __schedule_reset(self, expression_num, now: float) -> None:
+        if self.reset_after is None or expression_num == self.neutral:
+            self.reset_deadline = None
+        else:
+            self.reset_deadline = now + self.reset_after
+
+    def __next_wakeup(self, now: float) -> Optional[float]:
+        # 送るものがあれば送信間隔が空く時刻、なければ平常に戻す時刻まで待つ
+        if self.pending:
+            return max(0.0, self.last_send_time + self.min_interval - now)
+        if self.reset_deadline is not None:
+            return max(0.0, self.reset_deadline - now)
+        return None
+
+    def __send_forever(self) -> None:
+        while True:
+            with self.cond:
+                while not self.break_threads:
+                    now = time.monotonic()
+                    if self.reset_deadline is not None and now >= self.reset_deadline and not self.pending:
+                        self.reset_deadline = None
+                        if self.last_sent.get(EMOTE_ADDRESS, self.neutral) != self.neutral:
+                            self.pending[EMOTE_ADDRESS] = self.neutral
+                        continue
+
+                    wait = self.__next_wakeup(now)
+                    if wait == 0:
+                        break
+                    self.cond.wait(wait)
+
+                if self.break_threads:
+                    return
+
+                # 待っている間に元の値に戻ったものは送らない
+                params = {a: v for a, v in self.pending.items() if a not in self.last_sent or self.last_sent[a] != v}
+                self.pending = {}
+                if not params:
+                    continue
+
+                now = time.monotonic()
+                self.last_send_time = now
+                self.last_sent.update(params)
+                if EMOTE_ADDRESS in params:
+                    self.__schedule_reset(params[EMOTE_ADDRESS], now)
+
+            self.__send(params)
+
+    def __send(self, params: Dict[str, Any]) -> None:
+        bundle = OscBundleBuilder(IMMEDIATELY)
+        for address, value in params.items():
+            message = OscMessageBuilder(address=address)
+            message.add_arg(value)
+            bundle.add_content(message.build())
+
+        start = time.perf_counter()
+        try:
+            self.client.send(bundle.build())
+        except OSError as e:
+            self.logger.warning(f"Failed to send OSC bundle: {e}")
+            return
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="osc_send")
+
+        OSC_BUNDLES.inc()
+        OSC_MESSAGES.inc(len(params))
+        self.logger.info(f"send: {params}")
@@ -1,9 +1,25 @@
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List
+
 import torch
 from transformers import AutoModelForSequenceClassification, BertJapaneseTokenizer, pipeline, AutoTokenizer
 
+from utils import get_logger
+
 
 class SentimentAnalyzer:
-    def __init__(self) -> None:
+    def __init__(self, quantize: bool = True, max_length: int = 128, cache_size: int = 1024, batch_size: int = 16) -> None:
+        """
+        Args:
+            quantize (bool): CPUで推論する場合にLinear層を動的int8量子化する
+            max_length (int): 入力の最大トークン数。超えた分は切り捨てる
+            cache_size (int): 結果をキャッシュする文の数
+            batch_size (int): extract_batchで1回の推論にまとめる文の数
+        """
+        self.logger = get_logger("whisper_mic.sentiment", "info")
+
         device = "cuda:0" if torch.cuda.is_available() else "cpu"
         torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
 
@@ -14,6 +30,9 @@ class SentimentAnalyzer:
         )
         model.to(device)
 
+        if quantize and device == "cpu":
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
         tokenizer = AutoTokenizer.from_pretrained(model_id, cache_dir="./cache")
 
         self.pipe = pipeline(
@@ -24,11 +43,53 @@ class SentimentAnalyzer:
             device=device,
         )
 
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return unicodedata.normalize("NFKC", text).strip()
+
     def extract(self, text):
-        try:
-            result = self.pipe(text)
-        except Exception as e:
-            print(e)
-            # dummyの結果
-            result = [{'label': 'NEUTRAL', 'score': 0.9087327122688293}]
-        return result
+        return self.extract_batch([text])[0]
+
+    def extract_batch(self, texts: List[str]) -> List[list]:
+        """
+        複数の文をまとめて判定する。あいさつや笑い声のような繰り返し現れる文はキャッシュから返す
+
+        Returns:
+            List[list]: 文ごとの [{"label": ..., "score": ...}]
+        """
+        keys = [self._normalize(text) for text in texts]
+
+        results = {}
+        with self.cache_lock:
+            for key in keys:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    results[key] = self.cache[key]
+
+        missing = list(dict.fromkeys(key for key in keys if key not in results))
+        if missing:
+            try:
+                outputs = self.pipe(missing, batch_size=self.batch_size, truncation=True, max_length=self.max_length)
+            except Exception as e:
+                self.logger.warning(f"Sentiment analysis failed: {e}")
+                # dummyの結果。キャッシュはしない
+                outputs = None
+
+            with self.cache_lock:
+                for i, key in enumerate(missing):
+                    if outputs is None:
+                        results[key] = [{'label': 'NEUTRAL', 'score': 0.9087327122688293}]
+                        continue
+
+                    results[key] = [outputs[i]]
+                    self.cache[key] = results[key]
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+
+        return [results[key] for key in keys]
@@ -0,0 +1,159 @@
+import queue
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from audio_source import AudioSource, MicrophoneSource
+from audio_convert import CONVERTER
+from backends import ASRBackend
+from metrics import DECODE_SECONDS, DROPPED_SEGMENTS, REAL_TIME_FACTOR, SEGMENT_SECONDS
+from utils import get_logger
+from vad import EnergyVAD, VADSegmenter
+
+
+class TranscriptionServer:
+    """
+    1つのモデルを複数の入力ストリームで共有し、発話区間をまとめてバッチ推論する
+
+    最初の区間が届いてからmax_latency秒以内に集まった区間(最大max_batch_size件)を
+    1回のtranscribe_batchでデコードし、結果をストリームごとのキューに返す。
+    デコードに失敗した場合は、そのバッチに区間を送ったストリームのキューに例外を入れ、次のバッチの処理を続ける。
+    """
+
+    def __init__(self, backend: ASRBackend, max_batch_size: int = 8, max_latency: float = 0.2) -> None:
+        self.logger = get_logger("whisper_mic.server", "info")
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        if not backend.supports_batching:
+            self.logger.warning(
+                f"{type(backend).__name__} does not support batched inference; "
+                "segments from all streams will be decoded one at a time"
+            )
+
+        self.pending: "queue.Queue[Tuple[str, np.ndarray]]" = queue.Queue()
+        self.streams: Dict[str, "queue.Queue[Union[str, Exception]]"] = {}
+        self.banned_results = ["", " ", "\n", None]
+
+        self.break_threads = False
+        self.worker_thread = None
+
+    def add_stream(self, stream_id: str) -> "queue.Queue[Union[str, Exception]]":
+        self.streams[stream_id] = queue.Queue()
+        return self.streams[stream_id]
+
+    def submit(self, stream_id: str, audio_data) -> None:
+        self.pending.put_nowait((stream_id, audio_data))
+
+    def start(self) -> None:
+        self.worker_thread = threading.Thread(target=self.__batch_forever, daemon=True)
+        self.worker_thread.start()
+
+    def stop(self) -> None:
+        self.break_threads = True
+        if self.worker_thread is not None:
+            self.worker_thread.join()
+
+    def __collect_batch(self) -> List[Tuple[str, np.ndarray]]:
+        try:
+            batch = [self.pending.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch_size:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=wait))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def __batch_forever(self) -> None:
+        while not self.break_threads:
+            batch = self.__collect_batch()
+            if not batch:
+                continue
+
+            stream_ids = [stream_id for stream_id, _ in batch]
+            try:
+                audios = CONVERTER.convert_batch([audio_data for _, audio_data in batch])
+                start = time.perf_counter()
+                results = self.backend.transcribe_batch(audios)
+            except Exception as e:
+                # バッチ処理のスレッドは1つだけなので、ここで止まると全ストリームが待ち続けてしまう
+                self.logger.exception(f"Failed to decode batch of {len(batch)}")
+                DROPPED_SEGMENTS.inc(len(batch), reason="decode_error")
+                for stream_id in stream_ids:
+                    self.streams[stream_id].put_nowait(e)
+                continue
+            elapsed = time.perf_counter() - start
+            self.logger.debug(f"decoded batch of {len(batch)}")
+
+            # デコード時間と実時間比はバッチ単位で記録する
+            duration = sum(audio.shape[0] for audio in audios) / 16000
+            for audio in audios:
+                SEGMENT_SECONDS.observe(audio.shape[0] / 16000)
+            DECODE_SECONDS.observe(elapsed)
+            if duration > 0:
+                REAL_TIME_FACTOR.observe(elapsed / duration)
+
+            for stream_id, result in zip(stream_ids, results):
+                if result.text not in self.banned_results:
+                    self.streams[stream_id].put_nowait(result.text)
+
+
+class SourceStream:
+    """
+    1つの入力元の音声をVADで区切り、TranscriptionServerに送る
+    """
+
+    def __init__(
+        self,
+        server: TranscriptionServer,
+        stream_id: str,
+        source: AudioSource,
+        energy=300,
+        pause=0.8,
+        dynamic_energy=False,
+    ) -> None:
+        self.server = server
+        self.stream_id = stream_id
+        self.results = server.add_stream(stream_id)
+        self.source = source
+
+        self.segmenter = VADSegmenter(EnergyVAD(energy=energy, dynamic_energy=dynamic_energy), hangover=pause)
+        self.break_threads = False
+
+    @classmethod
+    def from_microphone(cls, server: TranscriptionServer, stream_id: str, mic_index=None, energy=300, **kwargs) -> "SourceStream":
+        import speech_recognition as sr
+
+        microphone = sr.Microphone(sample_rate=16000, device_index=mic_index)
+        recorder = sr.Recognizer()
+        recorder.energy_threshold = energy
+        with microphone:
+            recorder.adjust_for_ambient_noise(microphone)
+
+        return cls(server, stream_id, MicrophoneSource(microphone), energy=recorder.energy_threshold, **kwargs)
+
+    def start(self) -> None:
+        threading.Thread(target=self.__capture_forever, daemon=True).start()
+
+    def __capture_forever(self) -> None:
+        with self.source as source:
+            while not self.break_threads:
+                data = source.read()
+                if data is None:
+                    break
+                for segment in self.segmenter.process(data):
+                    self.server.submit(self.stream_id, segment)
+
+            segment = self.segmenter.flush()
+            if segment is not None:
+                self.server.submit(self.stream_id, segment)
@@ -0,0 +1,183 @@
+import os
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from backends import Result
+from vad import EnergyVAD
+
+
+@dataclass
+class TranscriptEvent:
+    """
+    kindは "partial"(未確定) か "committed"(確定)。
+    textは今回の差分、utteranceは発話全体の現時点のテキスト
+    """
+
+    kind: str
+    text: str
+    utterance: str
+    final: bool = False
+
+
+class LocalAgreement:
+    """
+    連続する2回の仮説で一致した接頭辞を確定とするコミット方針
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.committed = ""
+        self.previous = None
+
+    def update(self, hypothesis: str) -> Tuple[str, str]:
+        """
+        Returns:
+            Tuple[str, str]: 新たに確定したテキストと未確定のテキスト
+        """
+        new_committed = ""
+        if self.previous is not None:
+            agreed = os.path.commonprefix([self.previous, hypothesis])
+            if len(agreed) > len(self.committed) and agreed.startswith(self.committed):
+                new_committed = agreed[len(self.committed):]
+                self.committed = agreed
+
+        self.previous = hypothesis
+        return new_committed, hypothesis[len(self.committed):]
+
+    def finalize(self) -> str:
+        rest = ""
+        if self.previous is not None and self.previous.startswith(self.committed):
+            rest = self.previous[len(self.committed):]
+        self.reset()
+        return rest
+
+
+class StreamingTranscriber:
+    """
+    伸びていく音声ウィンドウを呼び出しごとに再デコードし、部分結果と確定結果を返す
+
+    発話後にend_silence秒の無音が続くか、ウィンドウがmax_window秒に達した時点で
+    残りを確定してウィンドウを破棄する。発話が始まるまではデコードしない。
+    transcribeの結果に単語ごとの終了時刻(Result.words)があれば、確定した単語までの音声を
+    ウィンドウから切り捨て、再デコードする長さを発話の長さによらず短く保つ。
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[np.ndarray], Result],
+        vad: Optional[EnergyVAD] = None,
+        end_silence: float = 0.8,
+        max_window: float = 15.0,
+        pre_roll: float = 0.3,
+    ) -> None:
+        self.transcribe = transcribe
+        self.vad = vad if vad is not None else EnergyVAD()
+        self.agreement = LocalAgreement()
+
+        sample_rate = self.vad.sample_rate
+        self.end_silence_frames = max(1, int(round(end_silence * sample_rate / self.vad.frame_size)))
+        self.max_window = int(max_window * sample_rate)
+        self.pre_roll = int(pre_roll * sample_rate)
+
+        self._window = np.empty(self.max_window, dtype=np.int16)
+        self._size = 0
+        # ウィンドウから切り捨てた音声のテキスト(確定済み)
+        self._trimmed_text = ""
+        self._reset_vad()
+
+    def _reset_vad(self) -> None:
+        self._vad_pos = 0
+        self._speech_seen = False
+        self._silence_frames = 0
+
+    def _append(self, samples: np.ndarray) -> None:
+        end = self._size + samples.shape[0]
+        if end > self._window.shape[0]:
+            window = np.empty(max(end, self._window.shape[0] * 2), dtype=np.int16)
+            window[:self._size] = self._window[:self._size]
+            self._window = window
+        self._window[self._size:end] = samples
+        self._size = end
+
+    def _update_vad(self) -> None:
+        frame_size = self.vad.frame_size
+        n_frames = (self._size - self._vad_pos) // frame_size
+        if n_frames == 0:
+            return
+
+        end = self._vad_pos + n_frames * frame_size
+        speech = self.vad.is_speech(self._window[self._vad_pos:end].reshape(n_frames, frame_size))
+        self._vad_pos = end
+
+        for is_speech in speech:
+            if is_speech:
+                self._speech_seen = True
+                self._silence_frames = 0
+            else:
+                self._silence_frames += 1
+
+    def _drop_silence(self) -> None:
+        # 発話前の無音はpre_roll分だけ残して捨てる
+        keep = min(self.pre_roll, self._size)
+        self._window[:keep] = self._window[self._size - keep:self._size].copy()
+        self._size = keep
+        self._reset_vad()
+
+    def _trim(self, words: List[Tuple[str, float]]) -> None:
+        # 確定したテキストに収まる最後の単語の終わりまでをウィンドウから捨てる
+        committed = len(self.agreement.committed) - len(self._trimmed_text)
+        length = 0
+        text = ""
+        end = None
+        for word, word_end in words:
+            if length + len(word) > committed:
+                break
+            length += len(word)
+            text += word
+            end = word_end
+
+        if end is None:
+            return
+        cut = min(int(end * self.vad.sample_rate), self._size)
+        if cut <= 0:
+            return
+
+        self._window[:self._size - cut] = self._window[cut:self._size].copy()
+        self._size -= cut
+        self._vad_pos = max(0, self._vad_pos - cut)
+        self._trimmed_text += text
+
+    def feed(self, data) -> List[TranscriptEvent]:
+        self._append(np.frombuffer(data, dtype=np.int16))
+        self._update_vad()
+
+        if not self._speech_seen:
+            self._drop_silence()
+            return []
+
+        result = self.transcribe(self._window[:self._size])
+        # 単語の時刻がある場合は、切り捨てる位置とテキストが一致するよう単語をつないだものを仮説とする
+        window_text = result.text if result.words is None else "".join(word for word, _ in result.words)
+        new_committed, partial = self.agreement.update(self._trimmed_text + window_text)
+
+        events = []
+        if self._silence_frames >= self.end_silence_frames or self._size >= self.max_window:
+            committed = self.agreement.committed
+            rest = self.agreement.finalize()
+            events.append(TranscriptEvent("committed", new_committed + rest, committed + rest, final=True))
+            self._size = 0
+            self._trimmed_text = ""
+            self._reset_vad()
+            return events
+
+        if result.words:
+            self._trim(result.words)
+
+        if new_committed:
+            events.append(TranscriptEvent("committed", new_committed, self.agreement.committed + partial))
+        events.append(TranscriptEvent("partial", partial, self.agreement.committed + partial))
+        return events
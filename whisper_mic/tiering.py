@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from backends import ASRBackend
+from metrics import REGISTRY
+from utils import get_logger
+
+PRIMARY = "primary"
+FAST = "fast"
+
+MODEL_TIER = REGISTRY.gauge("whisper_mic_model_tier", "Model tier in use (0: primary, 1: fast)")
+TIER_SWITCHES = REGISTRY.counter("whisper_mic_tier_switches_total", "Switches between model tiers, by destination tier")
+
+
+class TierRouter:
+    """
+    品質の高いモデル(primary)と速いモデル(fast)を、直近の実時間比(デコード時間/音声長)と
+    デコード待ちのキューの長さで使い分ける
+
+    primaryの実時間比がhigh_rtfを超えるかキューがhigh_pressure以上溜まるとfastに切り替え、
+    キューが空でprimaryの推定実時間比がlow_rtfを下回るとprimaryに戻す。
+    fastを使っている間のprimaryの実時間比は、切り替え時に測った2つのモデルの速度比から推定する。
+    切り替え後min_dwell秒は再度切り替えない。
+    """
+
+    def __init__(
+        self,
+        primary: ASRBackend,
+        fast: ASRBackend,
+        window: int = 8,
+        high_rtf: float = 0.8,
+        low_rtf: float = 0.5,
+        high_pressure: float = 0.5,
+        min_dwell: float = 5.0,
+    ) -> None:
+        if low_rtf >= high_rtf:
+            raise ValueError("low_rtf must be lower than high_rtf")
+
+        self.logger = get_logger("whisper_mic.tiering", "info")
+        self.backends = {PRIMARY: primary, FAST: fast}
+        self.history = {PRIMARY: deque(maxlen=window), FAST: deque(maxlen=window)}
+        self.high_rtf = high_rtf
+        self.low_rtf = low_rtf
+        self.high_pressure = high_pressure
+        self.min_dwell = min_dwell
+
+        self.tier = PRIMARY
+        self.switched_at = float("-inf")
+        self.primary_rtf_at_switch: Optional[float] = None
+        self.speed_ratio: Optional[float] = None
+        self.lock = threading.Lock()
+        MODEL_TIER.set(0)
+
+    def __mean(self, tier: str) -> Optional[float]:
+        values = self.history[tier]
+        return sum(values) / len(values) if values else None
+
+    def estimated_primary_rtf(self) -> Optional[float]:
+        if self.tier == PRIMARY:
+            return self.__mean(PRIMARY)
+
+        fast = self.__mean(FAST)
+        if fast is None or self.speed_ratio is None:
+            return None
+        return fast * self.speed_ratio
+
+    def record(self, tier: str, duration: float, elapsed: float) -> None:
+        if duration <= 0:
+            return
+
+        with self.lock:
+            self.history[tier].append(elapsed / duration)
+
+            # 切り替え直後のfastの結果から、同じ負荷でのprimaryとの速度比を求める
+            if tier == FAST and self.primary_rtf_at_switch is not None:
+                self.speed_ratio = self.primary_rtf_at_switch / self.__mean(FAST)
+                self.primary_rtf_at_switch = None
+
+    def select(self, pressure: float = 0.0):
+        """
+        Args:
+            pressure (float): デコード待ちのキューの割合(0〜1)
+
+        Returns:
+            Tuple[str, ASRBackend]: 使う階層とバックエンド
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.switched_at >= self.min_dwell:
+                if self.tier == PRIMARY:
+                    rtf = self.__mean(PRIMARY)
+                    if pressure >= self.high_pressure or (rtf is not None and rtf > self.high_rtf):
+                        # 速度比は今の負荷でのfastの結果から求め直す
+                        self.primary_rtf_at_switch = rtf
+                        self.history[FAST].clear()
+                        self.__switch(FAST, now, f"rtf={_format_rtf(rtf)}, queue={pressure:.0%}")
+                else:
+                    estimate = self.estimated_primary_rtf()
+                    # 速度比が分からない場合は、キューが空になった時点でprimaryを試す
+                    if pressure == 0 and (estimate is None or estimate < self.low_rtf):
+                        # 過負荷だった頃の値で再び切り替えないよう、primaryの履歴は捨てる
+                        self.history[PRIMARY].clear()
+                        self.__switch(PRIMARY, now, f"estimated rtf={_format_rtf(estimate)}")
+
+            return self.tier, self.backends[self.tier]
+
+    def __switch(self, tier: str, now: float, reason: str) -> None:
+        self.tier = tier
+        self.switched_at = now
+        MODEL_TIER.set(0 if tier == PRIMARY else 1)
+        TIER_SWITCHES.inc(to=tier)
+        self.logger.warning(f"Switching to the {tier} model ({reason})")
+
+
+def _format_rtf(rtf: Optional[float]) -> str:
+    return "unknown" if rtf is None else f"{rtf:.2f}"
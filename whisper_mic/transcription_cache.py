@@ -0,0 +1,177 @@
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from backends import Result
+from utils import get_logger
+
+
+def fingerprint(audio_data: np.ndarray, namespace: str = "", bits: int = 8) -> str:
+    """
+    float32波形のフィンガープリント
+
+    サンプルをbitsビットに量子化し、バックエンドの設定(namespace)と長さと合わせてハッシュする。
+    量子化でごく小さいノイズの違いは吸収されるため、無音区間は長さが同じなら同じキーになる。
+
+    Args:
+        namespace (str): ASRBackend.cache_keyなど、結果に影響する設定
+        bits (int): 量子化のビット数
+    """
+    scale = 2 ** (bits - 1) - 1
+    levels = np.round(np.clip(audio_data, -1.0, 1.0) * scale).astype(np.int8 if bits <= 8 else np.int16)
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(namespace.encode("utf-8"))
+    h.update(audio_data.shape[0].to_bytes(4, "little"))
+    h.update(levels.tobytes())
+    return h.hexdigest()
+
+
+class TranscriptionCache:
+    """
+    フィンガープリントをキーとした文字起こし結果のLRUキャッシュ
+
+    件数(max_entries)と結果のサイズの合計(max_bytes)のどちらかを超えると古いものから捨てる。
+    cache_dirを指定するとディスクにも保存し、メモリになければそちらを探す。
+    ディスクの合計がmax_disk_bytesを超えると、最後に使った時刻(mtime)の古いファイルから消す。
+    ディスクのキャッシュは実行をまたいで残るため、キーにはバックエンドの設定を含める(fingerprintのnamespace)。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 16 * 1024 * 1024,
+        cache_dir: Optional[str] = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.logger = get_logger("whisper_mic.cache", "info")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = 0
+        self.disk_lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in self.__disk_entries())
+
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+        }
+
+    def get(self, key: str) -> Optional[Result]:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return pickle.loads(self.entries[key])
+
+        data = self.__read_disk(key)
+        if data is not None:
+            self.disk_hits += 1
+            self.__put_memory(key, data)
+            return pickle.loads(data)
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, result: Result) -> None:
+        try:
+            data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # バックエンドの生の結果がpickleできない場合はテキストのみ保存
+            data = pickle.dumps(Result(text=result.text, words=result.words), protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.__put_memory(key, data)
+        self.__write_disk(key, data)
+
+    def __put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= len(self.entries.pop(key))
+            self.entries[key] = data
+            self.total_bytes += len(data)
+
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+    def __disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def __read_disk(self, key: str) -> Optional[bytes]:
+        if self.cache_dir is None:
+            return None
+        path = self.__disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # 消す順番を最後に使った時刻で決めるため、読んだファイルの時刻を更新する
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def __write_disk(self, key: str, data: bytes) -> None:
+        if self.cache_dir is None:
+            return
+        path = self.__disk_path(key)
+        try:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self.logger.warning(f"Could not write transcription cache: {e}")
+            return
+
+        with self.disk_lock:
+            self.disk_bytes += len(data) - previous
+            if self.disk_bytes > self.max_disk_bytes:
+                self.__prune_disk()
+
+    def __disk_entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.is_file() and entry.name.endswith(".pkl")]
+
+    def __prune_disk(self) -> None:
+        # 毎回消さずに済むよう、上限の9割まで減らす
+        target = self.max_disk_bytes * 0.9
+        try:
+            entries = sorted(self.__disk_entries(), key=lambda entry: entry.stat().st_mtime)
+        except OSError as e:
+            self.logger.warning(f"Could not list transcription cache: {e}")
+            return
+
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                continue
+        self.disk_bytes = total
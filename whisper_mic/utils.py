@@ -1,10 +1,15 @@
 import logging
+import os
+import sys
+from typing import List, Optional
+
 from typing_extensions import Literal
 from rich.logging import RichHandler
 
 
 def get_logger(name: str, level: Literal["info", "warning", "debug"]) -> logging.Logger:
-    rich_handler = RichHandler(level=logging.INFO, rich_tracebacks=True, markup=True)
+    # ハンドラでは絞らず、出力するレベルはloggerのレベルで決める
+    rich_handler = RichHandler(level=logging.NOTSET, rich_tracebacks=True, markup=True)
 
     logger = logging.getLogger(name)
     logger.setLevel(logging._nameToLevel[level.upper()])
@@ -15,3 +20,67 @@ def get_logger(name: str, level: Literal["info", "warning", "debug"]) -> logging
     logger.propagate = False
 
     return logger
+
+
+def get_default_device() -> str:
+    # torchのimportは重いため、デバイスが必要になった時点で読み込む
+    import torch
+
+    return "cuda:0" if torch.cuda.is_available() else "cpu"
+
+
+def parse_cpu_list(spec: str) -> List[int]:
+    """
+    "0-3,6" のようなCPU番号の指定をリストにする
+    """
+    cpus = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def configure_cpu(threads: int = 0, inter_threads: int = 0, affinity: Optional[str] = None) -> None:
+    """
+    CPUで推論する場合のスレッド数と、プロセスを割り当てるCPUを設定する
+
+    OpenMPなどはスレッドを作る時点の設定を使うため、モデルを読み込む前に呼ぶ。
+
+    Args:
+        threads (int): 1つの演算に使うスレッド数(intra-op)。0なら変更しない
+        inter_threads (int): 演算を並列に実行するスレッド数(inter-op)。0なら変更しない
+        affinity (str): "0-3,6" のようなCPU番号。Linuxのみ
+    """
+    logger = get_logger("whisper_mic.cpu", "info")
+
+    if affinity:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, parse_cpu_list(affinity))
+        else:
+            logger.warning("CPU affinity is not supported on this platform")
+
+    if threads > 0:
+        for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            os.environ[name] = str(threads)
+
+    # intra-opは環境変数で足りるため、torchはinter-opを指定した場合か読み込み済みの場合のみ設定する
+    if "torch" in sys.modules or inter_threads > 0:
+        try:
+            import torch
+        except ImportError:
+            return
+
+        if threads > 0:
+            torch.set_num_threads(threads)
+        if inter_threads > 0:
+            try:
+                torch.set_num_interop_threads(inter_threads)
+            except RuntimeError:
+                # 並列処理が始まった後は変更できない
+                logger.warning("inter-op threads must be configured before torch starts any parallel work")
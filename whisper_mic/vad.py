@@ -0,0 +1,169 @@
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class EnergyVAD:
+    """
+    フレーム単位のエネルギーとゼロ交差率による発話区間検出
+
+    energyはspeech_recognitionのenergy_thresholdと同じRMS(int16)の尺度。
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 30,
+        energy: float = 300,
+        max_zcr: float = 0.5,
+        dynamic_energy: bool = False,
+        dynamic_ratio: float = 3.0,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.frame_size = sample_rate * frame_ms // 1000
+        self.energy = energy
+        self.max_zcr = max_zcr
+        self.dynamic_energy = dynamic_energy
+        self.dynamic_ratio = dynamic_ratio
+        self.noise_floor = None
+
+    def threshold(self) -> float:
+        if self.dynamic_energy and self.noise_floor is not None:
+            return max(self.energy, self.noise_floor * self.dynamic_ratio)
+        return self.energy
+
+    def is_speech(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            frames (np.ndarray): (フレーム数, frame_size) のint16配列
+
+        Returns:
+            np.ndarray: フレームごとの発話判定(bool)
+        """
+        x = frames.astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        zcr = np.mean(np.signbit(x[:, 1:]) != np.signbit(x[:, :-1]), axis=1)
+
+        speech = (rms > self.threshold()) & (zcr < self.max_zcr)
+
+        # 非発話フレームから背景雑音のレベルを追従
+        if self.dynamic_energy and not speech.all():
+            noise = float(np.median(rms[~speech]))
+            self.noise_floor = noise if self.noise_floor is None else 0.9 * self.noise_floor + 0.1 * noise
+
+        return speech
+
+
+class VADSegmenter:
+    """
+    音声チャンクを逐次受け取り、前後に余白を付けた発話区間を切り出す
+
+    pre_rollは発話開始前に含める秒数、hangoverは発話終了と判定するまでの無音秒数。
+    """
+
+    def __init__(
+        self,
+        vad: Optional[EnergyVAD] = None,
+        pre_roll: float = 0.3,
+        hangover: float = 0.8,
+        min_speech: float = 0.25,
+        max_segment: float = 15.0,
+    ) -> None:
+        self.vad = vad if vad is not None else EnergyVAD()
+
+        frame_time = self.vad.frame_size / self.vad.sample_rate
+        self.hangover_frames = max(1, int(round(hangover / frame_time)))
+        self.min_speech_frames = max(1, int(round(min_speech / frame_time)))
+        self.max_segment_frames = max(1, int(round(max_segment / frame_time)))
+
+        self._pre_roll = deque(maxlen=max(0, int(round(pre_roll / frame_time))))
+        self._remainder = np.empty(0, dtype=np.int16)
+        self._frame_index = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._in_speech = False
+        self._frames = []
+        self._speech_frames = 0
+        self._silence_frames = 0
+        self._start_frame = 0
+
+    def _finish(self) -> Optional[Tuple[float, float, np.ndarray]]:
+        segment = None
+        if self._speech_frames >= self.min_speech_frames:
+            frame_time = self.vad.frame_size / self.vad.sample_rate
+            start = self._start_frame * frame_time
+            end = (self._start_frame + len(self._frames)) * frame_time
+            segment = (start, end, np.concatenate(self._frames))
+        self._reset()
+        return segment
+
+    def process(self, data) -> List[np.ndarray]:
+        """
+        Args:
+            data: int16 PCMのbytesまたはnp.ndarray
+
+        Returns:
+            List[np.ndarray]: このチャンクで確定した発話区間(int16)
+        """
+        return [segment for _, _, segment in self.process_timed(data)]
+
+    def process_timed(self, data) -> List[Tuple[float, float, np.ndarray]]:
+        """
+        processと同じだが、入力の先頭からの開始・終了秒数も返す
+
+        Returns:
+            List[Tuple[float, float, np.ndarray]]: (開始秒, 終了秒, 発話区間)
+        """
+        # concatenateでコピーされるため、呼び出し元のバッファは再利用されても構わない
+        samples = np.concatenate([self._remainder, np.frombuffer(data, dtype=np.int16)])
+        frame_size = self.vad.frame_size
+        n_frames = samples.shape[0] // frame_size
+        self._remainder = samples[n_frames * frame_size:].copy()
+
+        if n_frames == 0:
+            return []
+
+        frames = samples[: n_frames * frame_size].reshape(n_frames, frame_size)
+        speech = self.vad.is_speech(frames)
+
+        segments = []
+        for frame, is_speech in zip(frames, speech):
+            frame_index = self._frame_index
+            self._frame_index += 1
+
+            if not self._in_speech:
+                if is_speech:
+                    self._in_speech = True
+                    self._start_frame = frame_index - len(self._pre_roll)
+                    self._frames = list(self._pre_roll)
+                    self._frames.append(frame)
+                    self._speech_frames = 1
+                    self._pre_roll.clear()
+                else:
+                    self._pre_roll.append(frame)
+                continue
+
+            self._frames.append(frame)
+            if is_speech:
+                self._speech_frames += 1
+                self._silence_frames = 0
+            else:
+                self._silence_frames += 1
+
+            if self._silence_frames >= self.hangover_frames or len(self._frames) >= self.max_segment_frames:
+                segment = self._finish()
+                if segment is not None:
+                    segments.append(segment)
+
+        return segments
+
+    def flush(self) -> Optional[np.ndarray]:
+        segment = self.flush_timed()
+        return None if segment is None else segment[2]
+
+    def flush_timed(self) -> Optional[Tuple[float, float, np.ndarray]]:
+        if not self._in_speech:
+            return None
+        return self._finish()
@@ -2,6 +2,8 @@ import random
 
 from pythonosc import udp_client
 
+from osc_scheduler import BLINK_ADDRESS, EMOTE_ADDRESS, OSCScheduler
+
 
 EMOTION_DICT = {
     "平常": [1, 2, 3, 4, 5, 6, 7, 8, 9],
@@ -27,10 +29,17 @@ SENTIMENT_DICT = {
 
 
 class VRChatManager:
-    def __init__(self) -> None:
+    def __init__(self, min_interval: float = 0.2, reset_after: float = 15.0) -> None:
+        """
+        Args:
+            min_interval (float): OSCの送信の最小間隔(秒)
+            reset_after (float): 表情を平常に戻すまでの秒数。Noneなら戻さない
+        """
         ip = "127.0.0.1"
         port = 9000
         self.client = udp_client.SimpleUDPClient(ip, port)
+        # 変化した値だけをまとめて送り、一定時間後に平常の表情に戻す
+        self.scheduler = OSCScheduler(self.client, min_interval=min_interval, reset_after=reset_after)
 
     def choice_expression_by_sentiment(self, sentiments, expression_num):
         if sentiments:
@@ -83,14 +92,10 @@ class VRChatManager:
             expression_num, is_NEUTRAL = self.choice_expression_by_sentiment(sentiments, expression_num)
 
         # まばたき制御
-        if emotion in ["驚き"] or expression_num in NO_BLINK_NUMS:
-            self.client.send_message("/avatar/parameters/FaceEmo_CN_BLINK_ENABLE", False)
-        else:
-            self.client.send_message("/avatar/parameters/FaceEmo_CN_BLINK_ENABLE", True)
+        blink = not (emotion in ["驚き"] or expression_num in NO_BLINK_NUMS)
 
         # 送信
-        self.client.send_message("/avatar/parameters/FaceEmo_SYNC_EM_EMOTE", expression_num)
-        print("send: ", expression_num)
+        self.scheduler.update({BLINK_ADDRESS: blink, EMOTE_ADDRESS: expression_num})
 
         # 判定された感情に応じて感情解析を停止するか分岐
         if change_expression_by_emotion:
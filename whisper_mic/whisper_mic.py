@@ -1,32 +1,32 @@
-import torch
-import whisper
 import queue
 import speech_recognition as sr
 import threading
-import nue_asr
-import numpy as np
 import os
-import sys
-import time
 import tempfile
 import platform
-import pynput.keyboard
-
-from utils import get_logger
-
-# from distil_whisper import DistilWhisper
-# from hubert import Hubert
-# from fast_whisper import FasterWhisper
-from emotion_analysis import EmotionAnalyzer
-from sentiment_analysis import SentimentAnalyzer
-from vrchat_manager import VRChatManager
+import time
+from typing import List
+
+from analysis_pipeline import SENT_FILTERED, AnalysisPipeline
+from audio_buffer import AudioBuffer
+from audio_convert import CONVERTER
+from audio_file import iter_pcm16
+from audio_source import AudioSource, MicrophoneSource, create_source
+from backends import create_backend
+from backpressure import SegmentQueue
+from metrics import AUDIO_QUEUE_SECONDS, DECODE_SECONDS, DROPPED_SEGMENTS, REAL_TIME_FACTOR, SEGMENT_SECONDS, STAGE_SECONDS
+from streaming import StreamingTranscriber, TranscriptEvent
+from tiering import PRIMARY, TierRouter
+from transcription_cache import TranscriptionCache, fingerprint
+from utils import get_default_device, get_logger
+from vad import EnergyVAD, VADSegmenter
 
 
 class WhisperMic:
     def __init__(
         self,
         model="base",
-        device=("cuda:0" if torch.cuda.is_available() else "cpu"),
+        device=None,
         english=False,
         verbose=False,
         energy=300,
@@ -36,67 +36,155 @@ class WhisperMic:
         model_root="~/.cache/whisper",
         mic_index=None,
         vrchat=False,
+        backend="nue_asr",
+        prewarm=False,
+        vad=False,
+        pre_roll=0.3,
+        streaming=False,
+        stream_step=0.5,
+        lexicon_dir=None,
+        cache_size=0,
+        cache_dir=None,
+        cache_dir_size=256,
+        use_mic=True,
+        analysis=True,
+        source=None,
+        realtime=True,
+        queue_size=8,
+        overload="drop_oldest",
+        max_age=None,
+        fallback_model="tiny",
+        adaptive=False,
+        backend_options=None,
+        osc_interval=0.2,
+        expression_reset=15.0,
+        expression_service=False,
+        osc_listen_port=9001,
     ):
-        self.logger = get_logger("whisper_mic", "info")
+        self.logger = get_logger("whisper_mic", "debug" if verbose else "info")
         self.energy = energy
         self.pause = pause
         self.dynamic_energy = dynamic_energy
         self.save_file = save_file
         self.verbose = verbose
         self.english = english
-        self.keyboard = pynput.keyboard.Controller()
+        self.dictation = None
 
         self.platform = platform.system()
 
-        # self.distil_whisper = DistilWhisper()
-        # self.hubert = Hubert()
-        # self.faster_whisper = FasterWhisper()
-
-        self.emotion_analyzer = EmotionAnalyzer()
-        self.sentiment_analyzer = SentimentAnalyzer()
-        self.vrchat_manager = VRChatManager()
-
-        self.sent_filtered = [
-            "ご視聴ありがとうございました",
-            "チャンネル登録をお願いします",
-            "次回もお会いしましょう",
-            "ご覧いただきありがとうございます"
-        ]
+        self.sent_filtered = list(SENT_FILTERED)
 
         self.vrchat = vrchat
-        self.exec_emotion_analysis = True
+        self.osc_interval = osc_interval
+        self.expression_reset = expression_reset
+        # VRChatからのOSCを受け取り、アバター側での表情の変化も平常に戻す対象にする
+        self.use_expression_service = expression_service
+        self.osc_listen_port = osc_listen_port
+        self.expression_service = None
+        self.lexicon_dir = lexicon_dir
+        self.use_analysis = analysis
+        self.analysis = None
+
+        # 同じ音声(無音区間の繰り返しなど)のデコードを省く。cache_sizeが0なら無効
+        self.transcription_cache = None
+        if cache_size > 0:
+            self.transcription_cache = TranscriptionCache(
+                max_entries=cache_size, cache_dir=cache_dir, max_disk_bytes=cache_dir_size * 1024 * 1024
+            )
+
+        self.vad = vad
+        self.pre_roll = pre_roll
+        self.segmenter = None
+        self.streaming = streaming
+        self.stream_step = stream_step
+        self.streamer = None
+
+        if device is None:
+            device = get_default_device()
 
         if self.platform == "darwin":
             if device == "mps":
+                import torch
+
                 self.logger.warning("Using MPS for Mac, this does not work but may in the future")
                 device = "mps"
                 device = torch.device(device)
 
-        if (model != "large" and model != "large-v2") and self.english:
-            model = model + ".en"
-
-        self.use_nue_asr = True
-
-        if self.use_nue_asr:
-            self.audio_model = nue_asr.load_model("rinna/nue-asr")
-            self.tokenizer = nue_asr.load_tokenizer("rinna/nue-asr")
+        # backend_optionsはcompute_type, beam_size, temperature, cpu_threads, num_workersなど(ASRBackendを参照)
+        backend_options = backend_options or {}
+        self.backend = create_backend(
+            backend, model=model, device=device, english=english, model_root=model_root, **backend_options
+        )
+
+        # デコードが追いつかない場合に区間を捨てる・まとめる、または小さいモデルに切り替える
+        self.segment_queue = SegmentQueue(maxsize=queue_size, policy=overload, max_age=max_age)
+        self.fallback_backend = None
+        self.router = None
+        if adaptive or overload == "fallback":
+            # 同じモデルをもう1つ読み込んでも速くならず、メモリが倍になるだけ
+            if not self.backend.model_selectable:
+                raise ValueError(f"{backend} cannot load a different model, so adaptive and fallback tiers are not supported")
+            self.fallback_backend = create_backend(
+                backend, model=fallback_model, device=device, english=english, model_root=model_root, **backend_options
+            )
+            self.router = TierRouter(self.backend, self.fallback_backend)
+
+        # prewarmの場合はモデルの読み込みをバックグラウンドで行い、その間にマイクの準備と録音を進める
+        self.models_ready = threading.Event()
+        self.load_error = None
+        if prewarm:
+            self.prewarm_thread = threading.Thread(target=self.__load_models, args=(True,), daemon=True)
+            self.prewarm_thread.start()
         else:
-            self.audio_model = whisper.load_model(model, download_root=model_root).half().to(device)
-            for m in self.audio_model.modules():
-                if isinstance(m, whisper.model.LayerNorm):
-                    m.float()
+            self.__load_models()
+            self.__raise_load_error()
 
         self.temp_dir = tempfile.mkdtemp() if save_file else None
 
-        self.audio_queue = queue.Queue()
-        self.result_queue: "queue.Queue[str]" = queue.Queue()
+        # ストリーミングで読み出しが遅れても30秒分より古い音声は捨てる。
+        # listen()/record()は指定された長さをまとめて読み出すため上限を設けない
+        self.audio_buffer = AudioBuffer(max_size=16000 * 30 if streaming else None)
+        self.result_queue: "queue.Queue[str]" = queue.Queue(maxsize=queue_size)
 
         self.break_threads = False
+        self.capture_done = False
         self.mic_active = False
 
         self.banned_results = ["", " ", "\n", None]
 
-        self.__setup_mic(mic_index)
+        # 音声の入力元。sourceを指定しなければマイク、ファイルの文字起こしのみ行う場合は使わない
+        energy_threshold = self.energy
+        self.source = None
+        self.audio_source = None
+        self.source_open = False
+        if source is not None:
+            self.audio_source = source if isinstance(source, AudioSource) else create_source(source, realtime=realtime)
+            # マイク以外はspeech_recognitionで区切れないため、VADで区切る
+            self.vad = True
+        elif use_mic:
+            self.__setup_mic(mic_index)
+            self.audio_source = MicrophoneSource(self.source)
+            # 周囲の雑音から調整されたenergy_thresholdをVADの閾値に使う
+            energy_threshold = self.recorder.energy_threshold
+
+        if self.vad:
+            self.segmenter = VADSegmenter(
+                EnergyVAD(energy=energy_threshold, dynamic_energy=self.dynamic_energy),
+                pre_roll=self.pre_roll,
+                hangover=self.pause,
+            )
+
+        if self.streaming:
+            # 単語ごとの時刻を返せるバックエンドでは、確定した部分の音声を再デコードしない
+            for asr_backend in (self.backend, self.fallback_backend):
+                if asr_backend is not None and asr_backend.supports_word_timestamps:
+                    asr_backend.word_timestamps = True
+            self.streamer = StreamingTranscriber(
+                self.__decode,
+                EnergyVAD(energy=energy_threshold, dynamic_energy=self.dynamic_energy),
+                end_silence=self.pause,
+                pre_roll=self.pre_roll,
+            )
 
     def __setup_mic(self, mic_index):
         if mic_index is None:
@@ -113,37 +201,131 @@ class WhisperMic:
 
         self.logger.info("Mic setup complete")
 
-    def __preprocess(self, data):
-        return torch.from_numpy(np.frombuffer(data, np.int16).flatten().astype(np.float32) / 32768.0)
-
-    def __get_all_audio(self, min_time: float = -1.0):
-        audio = bytes()
-        got_audio = False
-        time_start = time.time()
-        while not got_audio or time.time() - time_start < min_time:
-            while not self.audio_queue.empty():
-                audio += self.audio_queue.get()
-                got_audio = True
-
-        data = sr.AudioData(audio, 16000, 2)
-        data = data.get_raw_data()
-        return data
+    def __load_models(self, warmup: bool = False) -> None:
+        try:
+            self.backend.load()
+            if warmup:
+                self.backend.warmup()
+            if self.fallback_backend is not None:
+                self.fallback_backend.load()
+                if warmup:
+                    self.fallback_backend.warmup()
+
+            if self.use_analysis:
+                self.__load_analysis()
+            self.logger.info("Models loaded")
+        except Exception as e:
+            self.load_error = e
+        finally:
+            self.models_ready.set()
+
+    def __load_analysis(self) -> None:
+        from emotion_analysis import EmotionAnalyzer
+        from sentiment_analysis import SentimentAnalyzer
+        from vrchat_manager import VRChatManager
+
+        if self.lexicon_dir is None:
+            self.emotion_analyzer = EmotionAnalyzer(debug=self.verbose)
+        else:
+            self.emotion_analyzer = EmotionAnalyzer(self.lexicon_dir, debug=self.verbose)
+        self.sentiment_analyzer = SentimentAnalyzer()
+        self.vrchat_manager = VRChatManager(min_interval=self.osc_interval, reset_after=self.expression_reset)
+        if self.vrchat and self.use_expression_service:
+            from expression_service import ExpressionService
+
+            self.expression_service = ExpressionService(self.vrchat_manager.scheduler, port=self.osc_listen_port)
+            self.expression_service.start()
+        self.analysis = AnalysisPipeline(
+            self.emotion_analyzer,
+            self.sentiment_analyzer,
+            self.vrchat_manager,
+            vrchat=self.vrchat,
+            sent_filtered=self.sent_filtered,
+        )
+        self.analysis.start()
+
+    def __raise_load_error(self) -> None:
+        if self.load_error is not None:
+            raise RuntimeError("Failed to load models") from self.load_error
+
+    def wait_until_ready(self, timeout=None) -> bool:
+        ready = self.models_ready.wait(timeout)
+        self.__raise_load_error()
+        return ready
+
+    def __get_all_audio(self, min_time: float = -1.0, timeout=None):
+        audio_data = self.audio_buffer.get(min_time=min_time, timeout=timeout)
+        AUDIO_QUEUE_SECONDS.set(len(self.audio_buffer) / 16000)
+        return audio_data
+
+    def __put_audio(self, data) -> None:
+        self.audio_buffer.put(data)
+        AUDIO_QUEUE_SECONDS.set(len(self.audio_buffer) / 16000)
+
+    # マイク以外の入力元は開いたままにして、listen()/record()の呼び出しごとに続きから読む
+    def __open_source(self) -> None:
+        if not self.source_open:
+            self.audio_source.open()
+            self.source_open = True
+
+    def __read_segment(self, timeout):
+        self.__open_source()
+        time_start = time.monotonic()
+        while True:
+            data = self.audio_source.read()
+            if data is None:
+                return self.segmenter.flush()
+
+            segments = self.segmenter.process(data)
+            if segments:
+                return segments[0]
+            if timeout is not None and time.monotonic() - time_start > timeout:
+                raise sr.WaitTimeoutError()
+
+    def __read_duration(self, duration, offset):
+        self.__open_source()
+        chunks = []
+        skip = int((offset or 0) * self.audio_source.sample_rate) * 2
+        remaining = None if duration is None else int(duration * self.audio_source.sample_rate) * 2
+        while remaining is None or remaining > 0:
+            data = self.audio_source.read()
+            if data is None:
+                break
+            if skip > 0:
+                data, skip = data[skip:], max(0, skip - len(data))
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            chunks.append(data)
+        return b"".join(chunks)
 
     # Handles the task of getting the audio input via microphone. This method has been used for listen() method
     def __listen_handler(self, timeout, phrase_time_limit):
         try:
+            if self.source is None:
+                segment = self.__read_segment(timeout)
+                if segment is not None:
+                    self.__transcribe(data=segment)
+                return
+
             with self.source as microphone:
                 audio = self.recorder.listen(source=microphone, timeout=timeout, phrase_time_limit=phrase_time_limit)
             self.__record_load(0, audio)
             audio_data = self.__get_all_audio()
             self.__transcribe(data=audio_data)
         except sr.WaitTimeoutError:
-            self.result_queue.put_nowait("Timeout: No speech detected within the specified time.")
+            self.__put_result("Timeout: No speech detected within the specified time.")
         except sr.UnknownValueError:
-            self.result_queue.put_nowait("Speech recognition could not understand audio.")
+            self.__put_result("Speech recognition could not understand audio.")
 
     # This method is similar to the __listen_handler() method but it has the added ability for recording the audio for a specified duration of time
     def __record_handler(self, duration, offset):
+        if self.source is None:
+            audio_data = self.__read_duration(duration, offset)
+            if audio_data:
+                self.__transcribe(data=audio_data)
+            return
+
         with self.source as microphone:
             audio = self.recorder.record(source=microphone, duration=duration, offset=offset)
 
@@ -151,134 +333,303 @@ class WhisperMic:
         audio_data = self.__get_all_audio()
         self.__transcribe(data=audio_data)
 
-    # This method takes the recorded audio data, converts it into raw format and stores it in a queue.
+    # This method takes the recorded audio data, converts it into raw format and stores it in the audio buffer.
     def __record_load(self, _, audio: sr.AudioData) -> None:
         data = audio.get_raw_data()
-        self.audio_queue.put_nowait(data)
+        self.__put_audio(data)
+
+    # listen_loopでspeech_recognitionが区切ったフレーズをデコード待ちのキューに入れる
+    def __enqueue_phrase(self, _, audio: sr.AudioData) -> None:
+        self.segment_queue.put(audio.get_raw_data())
+
+    # VADを使う場合は発話区間の判定を自前で行うため、入力元から連続してチャンクを読み込む
+    def __capture_forever(self) -> None:
+        try:
+            self.__open_source()
+            while not self.break_threads:
+                start = time.perf_counter()
+                data = self.audio_source.read()
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="read")
+                if data is None:
+                    break
+                if self.streamer is not None:
+                    self.__put_audio(data)
+                    continue
+
+                start = time.perf_counter()
+                segments = self.segmenter.process(data)
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="segment")
+                for segment in segments:
+                    self.segment_queue.put(segment)
+
+            # 入力が終わったら残りの発話もキューに入れる
+            if self.streamer is None:
+                segment = self.segmenter.flush()
+                if segment is not None:
+                    self.segment_queue.put(segment)
+        finally:
+            self.audio_source.close()
+            self.source_open = False
+            self.capture_done = True
+
+    # ワーカースレッドの例外はresult_queueで伝え、listen_loopが結果を待ち続けないようにする
+    def __run_worker(self, target) -> None:
+        try:
+            target()
+        except Exception as e:
+            self.logger.error(f"{target.__name__} failed: {e}")
+            self.__put_result(e)
 
     def __transcribe_forever(self) -> None:
-        while True:
-            if self.break_threads:
-                break
-            self.__transcribe()
+        while not self.break_threads:
+            # break_threadsを確認できるようにタイムアウト付きで待つ
+            segment = self.segment_queue.get(timeout=0.5)
+            if segment is None:
+                if self.capture_done:
+                    # 入力が終わったことを知らせる
+                    self.__put_result(None)
+                    break
+                continue
+            self.__transcribe(data=segment)
+
+    def __decode(self, audio_data):
+        self.wait_until_ready()
+        start = time.perf_counter()
+        try:
+            return self.__decode_cached(audio_data)
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="decode")
+
+    def __decode_cached(self, audio_data):
+        # 作業用バッファに変換するため、結果を返すまでの間だけ有効
+        start = time.perf_counter()
+        audio_data = CONVERTER.convert(audio_data)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="preprocess")
+
+        if self.router is None:
+            tier, backend = PRIMARY, self.backend
+        else:
+            tier, backend = self.router.select(self.segment_queue.pressure)
+
+        if self.transcription_cache is None:
+            return self.__run_backend(tier, backend, audio_data)
+
+        key = fingerprint(audio_data, namespace=backend.cache_key())
+        result = self.transcription_cache.get(key)
+        if result is None:
+            result = self.__run_backend(tier, backend, audio_data)
+            # 小さいモデルの結果はキャッシュしない
+            if tier == PRIMARY:
+                self.transcription_cache.put(key, result)
+        return result
+
+    def __run_backend(self, tier, backend, audio_data):
+        duration = audio_data.shape[0] / 16000
+        start = time.perf_counter()
+        result = backend.transcribe(audio_data)
+        elapsed = time.perf_counter() - start
+
+        if self.router is not None:
+            self.router.record(tier, duration, elapsed)
+
+        SEGMENT_SECONDS.observe(duration)
+        DECODE_SECONDS.observe(elapsed)
+        if duration > 0:
+            REAL_TIME_FACTOR.observe(elapsed / duration)
+        return result
+
+    # stream_step秒ごとに溜まった音声を追加し、部分結果と確定結果をTranscriptEventとしてresult_queueに流す
+    def __stream_forever(self) -> None:
+        while not self.break_threads:
+            audio_data = self.__get_all_audio(min_time=self.stream_step, timeout=0.5)
+            if audio_data is None:
+                if self.capture_done:
+                    self.__put_result(None)
+                    break
+                continue
+
+            for event in self.streamer.feed(audio_data):
+                if event.final:
+                    self.__analyze(event.utterance)
+                # 発話の終わりは結果が空でも伝え、打ち込み中の部分結果を確定させる
+                if event.final or event.utterance not in self.banned_results:
+                    self.__put_result(event)
 
     def __transcribe(self, data=None, realtime: bool = False) -> None:
         if data is None:
-            audio_data = self.__get_all_audio()
+            # break_threadsを確認できるようにタイムアウト付きで待つ
+            audio_data = self.__get_all_audio(timeout=0.5)
+            if audio_data is None:
+                return
         else:
             audio_data = data
 
-        # print("-----hubert")
-        # self.hubert.transcribe(audio_data)
+        result = self.transcribe(audio_data)
+        if result is not None:
+            self.__put_result(result)
 
-        # print("-----faster whisper")
-        # self.faster_whisper.transcribe(audio_data)
-
-        use_distil = False
+        if self.save_file:
+            os.remove(audio_data)
 
-        with torch.no_grad():
-            if use_distil:
-                # result = self.distil_whisper.transcribe(audio_data)
+    def __put_result(self, result) -> None:
+        # 表示が追いつかない場合は古い結果から捨てる
+        while True:
+            try:
+                self.result_queue.put_nowait(result)
+                return
+            except queue.Full:
+                pass
+            try:
+                self.result_queue.get_nowait()
+                DROPPED_SEGMENTS.inc(reason="result_queue_full")
+            except queue.Empty:
                 pass
-            elif self.use_nue_asr:
-                audio_data = self.__preprocess(audio_data)
-                result = nue_asr.transcribe(self.audio_model, self.tokenizer, audio_data)
-                predicted_text = result.text
-            else:
-                audio_data = self.__preprocess(audio_data)
-                if self.english:
-                    result = self.audio_model.transcribe(audio_data, language="english", fp16=True, beam_size=5)
-                else:
-                    result = self.audio_model.transcribe(audio_data, language="japanese", fp16=True, beam_size=5)
 
-                predicted_text = result["text"]
+    def transcribe(self, audio_data):
+        """
+        16bit PCMの音声を文字起こしし、感情解析まで行う
 
-        if self.exec_emotion_analysis and predicted_text != "":
-            no_filtered_sent = True
+        Returns:
+            文字起こし結果(verboseの場合はバックエンドの生の結果)。空の結果ならNone
+        """
+        result = self.__decode(audio_data)
+        predicted_text = result.text
 
-            # 無音状態での文字起こしへの対応
-            for sent in self.sent_filtered:
-                if sent in predicted_text:
-                    no_filtered_sent = False
+        self.__analyze(predicted_text)
 
-            if no_filtered_sent:
-                emotions = self.emotion_analyzer.extract_emotion(predicted_text)
-                sentiments = self.sentiment_analyzer.extract(predicted_text)
+        if predicted_text in self.banned_results:
+            return None
+        return result.raw if self.verbose else predicted_text
 
-                print("emotion", emotions)
-                print("sentiment", sentiments)
+    def transcribe_file(self, path: str) -> List[dict]:
+        """
+        音声ファイルを少しずつ読み込み、VADで区切った発話区間ごとに文字起こしする
 
-                if self.vrchat:
-                    disable_emotion_analysis = self.vrchat_manager.change_expression(emotions, sentiments)
+        Returns:
+            List[dict]: 発話区間ごとの {"path", "start", "end", "text"}
+        """
+        segmenter = VADSegmenter(
+            EnergyVAD(energy=self.energy, dynamic_energy=self.dynamic_energy), pre_roll=self.pre_roll, hangover=self.pause
+        )
 
-                    if disable_emotion_analysis:
-                        switch_emotion_analysis_thread = threading.Thread(target=self.__switch_emotion_analysis_once, args=(5,))
-                        switch_emotion_analysis_thread.setDaemon(True)
-                        switch_emotion_analysis_thread.start()
+        results = []
 
-        if not self.verbose:
-            if predicted_text not in self.banned_results:
-                self.result_queue.put_nowait(predicted_text)
-        else:
-            if predicted_text not in self.banned_results:
-                self.result_queue.put_nowait(result)
+        def decode(segments) -> None:
+            for start, end, segment in segments:
+                text = self.__decode(segment).text
+                if text not in self.banned_results:
+                    results.append({"path": path, "start": round(start, 2), "end": round(end, 2), "text": text})
 
-        if self.save_file:
-            os.remove(audio_data)
+        for samples in iter_pcm16(path):
+            decode(segmenter.process_timed(samples))
+
+        last = segmenter.flush_timed()
+        if last is not None:
+            decode([last])
 
-    def __switch_emotion_analysis_once(self, sleep_time):
-        self.exec_emotion_analysis = False
-        time.sleep(sleep_time)
-        self.exec_emotion_analysis = True
+        return results
 
-    def listen_loop(self, dictate: bool = False, phrase_time_limit=None) -> None:
-        self.recorder.listen_in_background(self.source, self.__record_load, phrase_time_limit=phrase_time_limit)
+    def __analyze(self, predicted_text: str) -> None:
+        # 解析は別スレッドで行い、文字起こしの結果を待たせない
+        if self.analysis is not None:
+            self.analysis.submit(predicted_text)
+
+    def listen_loop(self, dictate: bool = False, phrase_time_limit=None, paste_threshold: int = 16) -> None:
+        stop_listening = None
+        error = None
+        # 入力元を差し替えて再び呼べるよう、前回の終了状態を戻す
+        self.break_threads = False
+        self.capture_done = False
+        if self.segmenter is None and self.streamer is None:
+            stop_listening = self.recorder.listen_in_background(
+                self.source, self.__enqueue_phrase, phrase_time_limit=phrase_time_limit
+            )
+        else:
+            capture_thread = threading.Thread(target=self.__run_worker, args=(self.__capture_forever,), daemon=True)
+            capture_thread.start()
 
         # 文字起こし
-        transcribe_thread = threading.Thread(target=self.__transcribe_forever)
+        if self.streamer is None:
+            transcribe_thread = threading.Thread(target=self.__run_worker, args=(self.__transcribe_forever,))
+        else:
+            transcribe_thread = threading.Thread(target=self.__run_worker, args=(self.__stream_forever,))
         #transcribe_thread.setDaemon(True)
         transcribe_thread.start()
         self.logger.info("transcribe_thread start...")
 
         self.logger.info("Listening...")
 
-        is_loop = True
+        # キー入力は別スレッドで行い、結果の受け取りを止めない
+        if dictate:
+            from dictation import DictationSink
+
+            self.dictation = DictationSink(paste_threshold=paste_threshold)
+            self.dictation.start()
 
         try:
-            while is_loop:
+            while True:
                 result = self.result_queue.get()
-                if dictate:
-                    self.keyboard.type(result)
+                # 入力元が終わった
+                if result is None:
+                    break
+                # モデルの読み込みやデコードに失敗した。後片付けの後で呼び出し元に伝える
+                if isinstance(result, Exception):
+                    error = result
+                    break
+                if isinstance(result, TranscriptEvent):
+                    self.__show_event(result, dictate)
+                elif dictate:
+                    self.dictation.type_text(result)
                 else:
                     print(result)
-        except:
+        except KeyboardInterrupt:
+            self.logger.info("Stopping...")
+        finally:
             self.break_threads = True
-            is_loop = False
-            sys.exit()
-
-        transcribe_thread.join()
+            if stop_listening is not None:
+                stop_listening(wait_for_stop=False)
+            transcribe_thread.join()
+            if self.dictation is not None:
+                self.dictation.stop()
+                self.dictation = None
+
+        if error is not None:
+            raise error
+
+    def __show_event(self, event: TranscriptEvent, dictate: bool) -> None:
+        if dictate:
+            # 部分結果も打ち込み、変わった部分はDictationSinkが打ち直す
+            self.dictation.show(event)
+            return
+
+        # 未確定部分を含む発話全体を同じ行に上書き表示する。空で終わった発話は行を消すだけにする
+        utterance = "" if event.utterance in self.banned_results else event.utterance
+        print("\r" + utterance + "\033[K", end="\n" if event.final and utterance else "", flush=True)
+
+    # ハンドラは同期的に文字起こしまで終えるため、結果が空ならキューには何も入っていない
+    def __pop_result(self):
+        try:
+            return self.result_queue.get_nowait()
+        except queue.Empty:
+            return None
 
     def listen(self, timeout=None, phrase_time_limit=None):
         self.logger.info("Listening...")
         self.__listen_handler(timeout, phrase_time_limit)
-        while True:
-            if not self.result_queue.empty():
-                return self.result_queue.get()
+        return self.__pop_result()
 
     # This method is similar to the listen() method, but it has the ability to listen for a specified duration, mentioned in the "duration" parameter.
     def record(self, duration=None, offset=None):
         self.logger.info("Listening...")
         self.__record_handler(duration, offset)
-        while True:
-            if not self.result_queue.empty():
-                return self.result_queue.get()
+        return self.__pop_result()
 
     def toggle_microphone(self) -> None:
         # TO DO: make this work
         self.mic_active = not self.mic_active
         if self.mic_active:
-            print("Mic on")
+            self.logger.info("Mic on")
         else:
-            print("turning off mic")
+            self.logger.info("turning off mic")
             self.mic_thread.join()
-            print("Mic off")
+            self.logger.info("Mic off")